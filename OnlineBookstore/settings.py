@@ -40,11 +40,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'home.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'home.middleware.CustomerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -53,7 +55,7 @@ ROOT_URLCONF = 'OnlineBookstore.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'home.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -62,6 +64,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'home.context_processors.cart',
             ],
         },
     },
@@ -72,16 +75,75 @@ WSGI_APPLICATION = 'OnlineBookstore.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': '431ProjBookstore',
-        'USER': 'django',
-        'PASSWORD': 'password',
-        'HOST': 'localhost',
-        'PORT': 3306
+# the MySQL server and credentials come from BOOKSTORE_DB_NAME, BOOKSTORE_DB_USER, BOOKSTORE_DB_PASSWORD,
+# BOOKSTORE_DB_HOST and BOOKSTORE_DB_PORT; BOOKSTORE_SQLITE=<path> runs against a SQLite file instead, e.g. to generate
+# data and benchmark locally
+if os.environ.get('BOOKSTORE_SQLITE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'home.db_backends.sqlite3',
+            'NAME': os.environ['BOOKSTORE_SQLITE'],
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'home.db_backends.mysql',
+            'NAME': os.environ.get('BOOKSTORE_DB_NAME', '431ProjBookstore'),
+            'USER': os.environ.get('BOOKSTORE_DB_USER', 'django'),
+            'PASSWORD': os.environ.get('BOOKSTORE_DB_PASSWORD', 'password'),
+            'HOST': os.environ.get('BOOKSTORE_DB_HOST', 'localhost'),
+            'PORT': int(os.environ.get('BOOKSTORE_DB_PORT', 3306)),
+        }
+    }
+# connections are kept between requests for BOOKSTORE_DB_CONN_MAX_AGE seconds (0 closes them after every request,
+# 'none' keeps them for good) and checked on their first use in a request unless BOOKSTORE_DB_HEALTH_CHECKS=0;
+# BOOKSTORE_DB_POOL_SIZE=<n> instead shares a pool of n idle connections between the threads of a process, with up to
+# BOOKSTORE_DB_POOL_OVERFLOW more under load and BOOKSTORE_DB_POOL_TIMEOUT seconds to wait once all are in use
+DB_POOL_SIZE = int(os.environ.get('BOOKSTORE_DB_POOL_SIZE', 0))
+DB_CONN_MAX_AGE = os.environ.get('BOOKSTORE_DB_CONN_MAX_AGE', '0' if DB_POOL_SIZE else '60')
+DATABASES['default'].update({
+    'CONN_MAX_AGE': None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE),
+    'HEALTH_CHECKS': os.environ.get('BOOKSTORE_DB_HEALTH_CHECKS', '1') != '0',
+    'POOL': {
+        'SIZE': DB_POOL_SIZE,
+        'OVERFLOW': int(os.environ.get('BOOKSTORE_DB_POOL_OVERFLOW', 10)),
+        'TIMEOUT': float(os.environ.get('BOOKSTORE_DB_POOL_TIMEOUT', 30)),
+    } if DB_POOL_SIZE else None,
+})
+
+# Caches
+# the default cache holds the content versions and the tiers hold cached content, each with its own time to live
+# and size bound, evicting the least recently used entries first; every cache counts its hits, misses and evictions
+CACHE_TIERS = {
+    # content versions, never expired
+    'default': {'TIMEOUT': None, 'MAX_ENTRIES': 10000},
+    # search choices, anonymous pages and page fragments, keyed by content versions
+    'catalog': {'TIMEOUT': 600, 'MAX_ENTRIES': 5000},
+    # customer rows, trust sets, cart summaries and trusted score results
+    'user': {'TIMEOUT': 300, 'MAX_ENTRIES': 10000},
+    # manager reports
+    'reports': {'TIMEOUT': 60, 'MAX_ENTRIES': 200},
 }
+# local memory per process by default; BOOKSTORE_CACHE_DIR=<path> shares files between the processes of a machine,
+# BOOKSTORE_REDIS_URL=<url> uses Redis (with django-redis), BOOKSTORE_REDIS_URL_<TIER> gives a tier its own server,
+# whose maxmemory and an allkeys-lru maxmemory-policy then bound its size
+CACHES = {}
+for tier, options in CACHE_TIERS.items():
+    redis_url = os.environ.get(f'BOOKSTORE_REDIS_URL_{tier.upper()}', os.environ.get('BOOKSTORE_REDIS_URL'))
+    if redis_url:
+        backend, location = 'home.cache_backends.RedisCache', redis_url
+    elif os.environ.get('BOOKSTORE_CACHE_DIR'):
+        backend, location = 'home.cache_backends.FileBasedCache', os.path.join(os.environ['BOOKSTORE_CACHE_DIR'], tier)
+    else:
+        backend, location = 'home.cache_backends.LocMemCache', tier
+    CACHES[tier] = {
+        'BACKEND': backend,
+        'LOCATION': location,
+        'KEY_PREFIX': tier,
+        'TIMEOUT': options['TIMEOUT'],
+        'OPTIONS': {} if redis_url else {'MAX_ENTRIES': options['MAX_ENTRIES']},
+    }
 
 # # show executed SQL in console
 # LOGGING = {
@@ -146,3 +208,14 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 # Other
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 LOGIN_REDIRECT_URL = 'home'
+# let each customer rate a comment only once
+COMMENT_VOTE_LEDGER = True
+# seconds the Customer row of a logged in user stays cached between requests, 0 reads it on every request
+CUSTOMER_CACHE_TIMEOUT = 60
+# request samples kept per url name for the view stats page
+INSTRUMENTATION_SAMPLES = 1000
+# the most queries a request to a url name may issue, exceeding it logs a warning or raises with QUERY_BUDGETS_RAISE
+QUERY_BUDGETS = {}
+QUERY_BUDGETS_RAISE = False
+# the default window of the manager book report, in days
+SALES_REPORT_DAYS = 90
@@ -0,0 +1,83 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from . import views
+from .middleware import get_customer
+from .recommendations import recommend_books
+from .utils import *
+
+# Async variants of the read only catalog pages, for ASGI servers. The ORM is synchronous, so every query runs in a
+# worker thread; queries that do not depend on each other run in separate threads at the same time, and the event
+# loop serves other requests while they wait on the database. Writes and forms are left to the synchronous views.
+
+
+# run a blocking function in a worker thread of its own, the thread's connection is released afterwards as at the
+# end of a request (or kept for CONN_MAX_AGE)
+def in_thread(function, *args, **kwargs):
+    def run():
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+# render in the request's thread, context processors and lazy context values may still query
+async def render_async(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context=context)
+
+
+# best sellers and recommendations are read at the same time
+async def index(request):
+    # visitors that are not customers see any books, as on the synchronous page
+    async def recommended_books():
+        customer = await in_thread(get_customer, request)
+        if customer:
+            return await in_thread(recommend_books, customer)
+        return await in_thread(lambda: list(Book.objects.values('isbn', 'title', 'price')[:10]))
+
+    most_purchased_books, recommended = await asyncio.gather(in_thread(lambda: list(get_best_sellers())),
+                                                             recommended_books())
+    context = {'most_purchased_books': most_purchased_books,
+               'recommended_books': recommended}
+    return await render_async(request, 'index.html', context)
+
+
+# the book, its comments and the viewer's trust sets are read at the same time
+async def book_detail(request, isbn_str):
+    if request.method != 'GET':
+        return await sync_to_async(views.book_detail)(request, isbn_str)
+    count, cursor = get_comment_page_request(request)
+
+    async def trust_sets():
+        customer = await in_thread(get_customer, request)
+        return customer, (await in_thread(get_trust_sets, customer) if customer else None)
+
+    book, (comments, next_cursor), (customer, customer_trust_sets) = await asyncio.gather(
+        in_thread(Book.objects.filter(isbn=isbn_str).first), in_thread(get_top_comments, isbn_str, count, cursor),
+        trust_sets())
+    if book is None:
+        raise Http404('ISBN does not exist')
+    # the authors are only read when the cached header fragment is missing as the page renders
+    context = await in_thread(get_book_detail_context, book, Author.objects.filter(isbn=isbn_str), comments,
+                              next_cursor, count, customer, customer_trust_sets)
+    return await render_async(request, 'book_detail.html', context)
+
+
+# a search is a single query after the full text lookup, so there is nothing to overlap; it runs in a worker thread
+# so that the event loop keeps serving other requests meanwhile. The blank form is rendered here rather than through
+# the synchronous view, whose cached anonymous page does not apply to the async views
+async def book_search(request):
+    if request.method != 'POST' and 'book_search' not in request.GET:
+        return await render_async(request, 'book_search.html', await in_thread(search_form_context))
+    return await in_thread(views.book_search, request)
+
+
+# the lookup walks the in-memory co-author graph and reads the books in one query, which depends on the walk; it runs
+# in a worker thread like the search
+async def degree_of_separation_search(request):
+    return await in_thread(views.DegreeOfSeparationSearchView.as_view(), request)
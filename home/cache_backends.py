@@ -0,0 +1,116 @@
+import random
+import threading
+from collections import Counter, defaultdict
+
+from django.core.cache.backends import filebased, locmem
+
+try:
+    from django_redis.cache import RedisCache as BaseRedisCache
+except ImportError:
+    # only needed when BOOKSTORE_REDIS_URL is set
+    BaseRedisCache = None
+
+# what is counted for every cache tier
+STATS = ('hits', 'misses', 'evictions')
+
+# marks a miss, since None can be a cached value
+MISSING = object()
+
+
+# hits, misses and evictions per tier, kept per process since the cache handler makes a backend per thread
+class CacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(Counter)
+
+    def add(self, tier, stat, count=1):
+        if count:
+            with self.lock:
+                self.counts[tier][stat] += count
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+
+    # {tier: {'hits', 'misses', 'evictions', 'hit_rate'}}, with the given tiers included even if never used
+    def summary(self, tiers=()):
+        with self.lock:
+            counts = {tier: dict(tier_counts) for tier, tier_counts in self.counts.items()}
+        summary = {}
+        for tier in sorted(set(counts) | set(tiers)):
+            summary[tier] = {stat: counts.get(tier, {}).get(stat, 0) for stat in STATS}
+            lookups = summary[tier]['hits'] + summary[tier]['misses']
+            summary[tier]['hit_rate'] = summary[tier]['hits'] / lookups if lookups else 0
+        return summary
+
+
+cache_stats = CacheStats()
+
+
+# the summary in the Prometheus text exposition format
+def cache_prometheus_text(summary):
+    lines = []
+    for stat in STATS:
+        name = f'bookstore_cache_{stat}_total'
+        lines.append(f'# HELP {name} Cache {stat} per tier')
+        lines.append(f'# TYPE {name} counter')
+        for tier, counts in summary.items():
+            lines.append(f'{name}{{tier="{tier}"}} {counts[stat]}')
+    return '\n'.join(lines) + '\n'
+
+
+# counts the hits and misses of a backend; the tier is its KEY_PREFIX, which also keeps tiers sharing a server apart
+class CountingMixin:
+    @property
+    def tier(self):
+        return self.key_prefix or 'default'
+
+    def get(self, key, default=None, version=None, **kwargs):
+        value = super().get(key, MISSING, version=version, **kwargs)
+        cache_stats.add(self.tier, 'misses' if value is MISSING else 'hits')
+        return default if value is MISSING else value
+
+
+# local memory, evicting the least recently used entries one at a time once MAX_ENTRIES is reached
+# (Django's own culls a third of the entries at once by default)
+class LocMemCache(CountingMixin, locmem.LocMemCache):
+    def _cull(self):
+        evicted = 0
+        while self._cache and len(self._cache) >= self._max_entries:
+            # entries are kept most recently used first
+            key, _ = self._cache.popitem()
+            del self._expire_info[key]
+            evicted += 1
+        cache_stats.add(self.tier, 'evictions', evicted)
+
+    def size(self):
+        return len(self._cache)
+
+
+# files shared by the processes of one machine, culled at random once MAX_ENTRIES is reached
+class FileBasedCache(CountingMixin, filebased.FileBasedCache):
+    def _cull(self):
+        files = self._list_cache_files()
+        if len(files) < self._max_entries:
+            return
+        if self._cull_frequency:
+            files = random.sample(files, len(files) // self._cull_frequency)
+        cache_stats.add(self.tier, 'evictions', len([name for name in files if self._delete(name)]))
+
+    def size(self):
+        return len(self._list_cache_files())
+
+
+if BaseRedisCache is not None:
+    # a Redis server whose maxmemory-policy evicts, evictions are only known to the server so they are not counted
+    class RedisCache(CountingMixin, BaseRedisCache):
+        # fetched in one round trip rather than through get, so counted here
+        def get_many(self, keys, version=None, **kwargs):
+            keys = list(keys)
+            values = super().get_many(keys, version=version, **kwargs)
+            cache_stats.add(self.tier, 'hits', len(values))
+            cache_stats.add(self.tier, 'misses', len(keys) - len(values))
+            return values
+
+        def size(self):
+            return None
@@ -0,0 +1,68 @@
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+# Cached values are keyed by a version number so that a whole family of keys can be invalidated by bumping it.
+# A missing version starts at the current time, thus keys from before an eviction of the version are never reused.
+# Versions live in the default cache, the values in one of the tiers configured in CACHE_TIERS.
+
+CATALOG_TIER = 'catalog'
+USER_TIER = 'user'
+REPORTS_TIER = 'reports'
+
+# bumped whenever a Book or an Author changes
+CATALOG_VERSION = 'catalog'
+# bumped whenever an Author changes
+AUTHOR_VERSION = 'author'
+# bumped whenever a Comment is written
+COMMENT_VERSION = 'comment'
+# bumped whenever books are sold or the sales tables are rebuilt
+SALES_VERSION = 'sales'
+
+
+# bumped whenever a customer trusts or untrusts someone
+def trust_version(customer_pk):
+    return f'trust:{customer_pk}'
+
+# bumped whenever a customer's shopping cart changes
+def cart_version(customer_pk):
+    return f'cart:{customer_pk}'
+
+# bumped whenever a book, its authors, its stock or its comments and their ratings change
+def book_version(isbn):
+    return f'book:{isbn}'
+
+
+def get_version(name):
+    key = f'version:{name}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    key = f'version:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+# get a cached value tied to a version from a cache tier, computing it on a miss
+# without a version the value is only refreshed when it expires
+def get_or_compute(key, version_name, compute, tier, timeout=DEFAULT_TIMEOUT):
+    versioned_key = f'{key}:{get_version(version_name)}' if version_name else key
+    value = caches[tier].get(versioned_key)
+    if value is None:
+        value = compute()
+        caches[tier].set(versioned_key, value, timeout=timeout)
+    return value
+
+
+# empty every cache tier
+def clear_caches():
+    for tier_cache in caches.all():
+        tier_cache.clear()
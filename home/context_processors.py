@@ -0,0 +1,12 @@
+from .utils import get_cart_summary
+
+
+# the item count and total price of the logged in customer's cart, for the cart badge on every page
+def cart(request):
+    if not request.user.is_authenticated:
+        return {}
+    summary = get_cart_summary(request.user.pk)
+    return {
+        'cart_count': summary['count'],
+        'cart_total': summary['total'],
+    }
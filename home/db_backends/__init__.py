@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import Counter
+
+from django.db.utils import OperationalError
+
+# Database backends that check persistent connections before reusing them and can share a bounded pool of raw
+# connections between the threads of a process. A database configures them with extra keys next to CONN_MAX_AGE:
+#   HEALTH_CHECKS: check a persistent connection on its first use in every request, and a pooled connection before
+#                  handing it out, replacing it if the server dropped it
+#   POOL: {'SIZE': idle connections kept open, 'OVERFLOW': connections opened beyond SIZE under load and closed
+#          once returned, 'TIMEOUT': seconds to wait for a connection once SIZE + OVERFLOW are in use}
+# A pooled database should have a CONN_MAX_AGE of 0, so that connections go back to the pool at the end of every
+# request instead of staying with the thread that served it.
+
+
+# raised when no pooled connection is returned within the pool's TIMEOUT
+class PoolTimeout(OperationalError):
+    pass
+
+
+# raw connections to one database, shared by the threads of a process
+class ConnectionPool:
+    def __init__(self, size=5, overflow=10, timeout=30):
+        self.size = size
+        self.overflow = overflow
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # returned connections, the most recently returned last
+        self.idle = []
+        # connections that are open, idle or in use
+        self.opened = 0
+        self.counts = Counter()
+
+    # an idle connection that passes `check`, or a new one from `connect` while fewer than SIZE + OVERFLOW are open
+    def acquire(self, connect, check=None):
+        while True:
+            raw = self.checkout()
+            if raw is None:
+                try:
+                    raw = connect()
+                except Exception:
+                    self.discard(None)
+                    raise
+                self.counts['connects'] += 1
+                return raw
+            if check is None or check(raw):
+                self.counts['reuses'] += 1
+                return raw
+            self.counts['failed_checks'] += 1
+            self.discard(raw)
+
+    # an idle connection, or None once a slot to open a new one is reserved
+    def checkout(self):
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while not self.idle and self.opened >= self.size + self.overflow:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counts['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection was returned to the pool within {self.timeout}s, '
+                                      f'all {self.size + self.overflow} are in use')
+                self.condition.wait(remaining)
+            if self.idle:
+                return self.idle.pop()
+            self.opened += 1
+            return None
+
+    # take back a connection that is no longer used, overflow connections are closed
+    def release(self, raw):
+        with self.condition:
+            if len(self.idle) < self.size:
+                self.idle.append(raw)
+                self.condition.notify()
+                return
+        self.discard(raw)
+
+    # close a connection that cannot be reused (or give up a reserved slot) and let a waiting thread open a new one
+    def discard(self, raw):
+        if raw is not None:
+            try:
+                raw.close()
+            except Exception:
+                pass
+        with self.condition:
+            self.opened -= 1
+            self.condition.notify()
+
+    def close_idle(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for raw in idle:
+            self.discard(raw)
+
+    def stats(self):
+        with self.condition:
+            return {'size': self.size, 'overflow': self.overflow, 'opened': self.opened, 'idle': len(self.idle),
+                    **self.counts}
+
+
+# one pool per database, shared by the connection wrappers of every thread
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(settings_dict):
+    # the test runner renames the database, whose connections then go to a pool of their own
+    key = tuple(settings_dict[name] for name in ('ENGINE', 'NAME', 'HOST', 'PORT', 'USER'))
+    with pools_lock:
+        if key not in pools:
+            options = {name.lower(): value for name, value in settings_dict['POOL'].items()}
+            pools[key] = ConnectionPool(**options)
+        return pools[key]
+
+
+# close the idle connections of every pool, e.g. before the database is dropped or between benchmark runs
+def close_pools():
+    with pools_lock:
+        all_pools = list(pools.values())
+        pools.clear()
+    for pool in all_pools:
+        pool.close_idle()
+
+
+class PooledDatabaseMixin:
+    # whether the connection was checked since the request started
+    health_checked = True
+
+    @property
+    def pool(self):
+        return get_pool(self.settings_dict) if self.settings_dict.get('POOL') else None
+
+    # a new raw connection to the database
+    def open_connection(self, conn_params):
+        return super().get_new_connection(conn_params)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return self.open_connection(conn_params)
+        check = self.check_raw_connection if self.settings_dict.get('HEALTH_CHECKS') else None
+        return pool.acquire(lambda: self.open_connection(conn_params), check)
+
+    # a connection is checked with a round trip, servers drop idle connections after a while (wait_timeout on MySQL)
+    def check_raw_connection(self, raw):
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except self.Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        raw = self.connection
+        # a connection closed inside a transaction or after an error is not trusted with another request
+        if self.in_atomic_block or self.errors_occurred:
+            pool.discard(raw)
+            return
+        try:
+            if not self.autocommit:
+                raw.rollback()
+        except self.Database.Error:
+            pool.discard(raw)
+            return
+        pool.release(raw)
+
+    # called when a request starts and finishes, the connection kept for the next request is checked on its first use
+    def close_if_unusable_or_obsolete(self):
+        self.health_checked = True
+        super().close_if_unusable_or_obsolete()
+        self.health_checked = False
+
+    def ensure_connection(self):
+        if not self.health_checked and self.connection is not None and self.settings_dict.get('HEALTH_CHECKS') \
+                and not self.in_atomic_block:
+            if not self.is_usable():
+                # marked so that it is closed rather than returned to the pool
+                self.errors_occurred = True
+                self.close()
+        self.health_checked = True
+        super().ensure_connection()
@@ -0,0 +1,7 @@
+from django.db.backends.mysql import base
+
+from home.db_backends import PooledDatabaseMixin
+
+
+class DatabaseWrapper(PooledDatabaseMixin, base.DatabaseWrapper):
+    pass
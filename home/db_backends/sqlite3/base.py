@@ -0,0 +1,8 @@
+from django.db.backends.sqlite3 import base
+
+from home.db_backends import PooledDatabaseMixin
+
+
+# for local data generation and benchmarks, a pool of connections to a SQLite file stands in for one to MySQL
+class DatabaseWrapper(PooledDatabaseMixin, base.DatabaseWrapper):
+    pass
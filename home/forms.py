@@ -1,8 +1,27 @@
 from django import forms
 from django.core.exceptions import ValidationError
 
+from .caching import get_or_compute, CATALOG_VERSION, CATALOG_TIER
 from .models import Book, Author
 
+EMPTY_SELECTION = [('', '---')]
+
+
+# choices are loaded lazily from a cache that is invalidated whenever a book or an author changes
+def author_choices():
+    return get_or_compute('author_choices', CATALOG_VERSION, lambda: [
+        (f'{i[0]}_{i[1]}', f'{i[0]} {i[1]}')
+        for i in Author.objects.values_list('first_name', 'last_name').order_by('last_name').distinct()], CATALOG_TIER)
+
+
+def book_field_choices(field):
+    return get_or_compute(f'{field}_choices', CATALOG_VERSION, lambda: [
+        (i, i) for i in Book.objects.values_list(field, flat=True).order_by(field).distinct()], CATALOG_TIER)
+
+
+def optional(choices):
+    return lambda: EMPTY_SELECTION + choices()
+
 
 class SignUpForm(forms.Form):
     username = forms.CharField(max_length=30)
@@ -14,35 +33,28 @@ class SignUpForm(forms.Form):
 
 
 class BookSearchForm(forms.Form):
-    EMPTY_SELECTION = [('', '---')]
     SORT_CHOICE = {'publication_date': 'Publish Date',
                    'score': 'Average Score',
                    'trusted_score': 'Average Trusted User Score'}
 
+    query = forms.CharField(max_length=100, required=False, label='Search',
+                            help_text='Words from the title, authors, keywords, subject or publisher')
     isbn = forms.CharField(max_length=13, required=False, label='ISBN')
     title = forms.CharField(max_length=100, required=False)
     publisher = forms.CharField(max_length=100, required=False)
-    author_choices = EMPTY_SELECTION + [(f'{i[0]}_{i[1]}', f'{i[0]} {i[1]}') for i in Author.objects.values_list(
-        'first_name', 'last_name').order_by('last_name').distinct()]
-    subject_choices = EMPTY_SELECTION + [(i, i) for i in Book.objects.values_list('subject', flat=True).order_by(
-        'subject').distinct()]
-    keywords_choices = EMPTY_SELECTION + [(i, i) for i in Book.objects.values_list('keywords', flat=True).order_by(
-        'keywords').distinct()]
-    language_choices = EMPTY_SELECTION + [(i, i) for i in Book.objects.values_list('language', flat=True).order_by(
-        'language').distinct()]
     sort_by_choices = EMPTY_SELECTION + [(i, i) for i in SORT_CHOICE.values()]
-    author = forms.ChoiceField(choices=author_choices, required=False)
-    subject = forms.ChoiceField(choices=subject_choices, required=False)
-    keywords = forms.ChoiceField(choices=keywords_choices, required=False, label='Keyword')
-    language = forms.ChoiceField(choices=language_choices, required=False)
+    author = forms.ChoiceField(choices=optional(author_choices), required=False)
+    subject = forms.ChoiceField(choices=optional(lambda: book_field_choices('subject')), required=False)
+    keywords = forms.ChoiceField(choices=optional(lambda: book_field_choices('keywords')), required=False,
+                                 label='Keyword')
+    language = forms.ChoiceField(choices=optional(lambda: book_field_choices('language')), required=False)
     sort_by = forms.ChoiceField(choices=sort_by_choices, required=False)
 
     def clean(self):
         super().clean()
         data = self.cleaned_data
-        if data['isbn'] == '' and data['title'] == '' and data['publisher'] == '' and data['author'] == '' and data[
-            'subject'] == '' and \
-                data['keywords'] == '' and data['language'] == '':
+        if data['query'] == '' and data['isbn'] == '' and data['title'] == '' and data['publisher'] == '' and \
+                data['author'] == '' and data['subject'] == '' and data['keywords'] == '' and data['language'] == '':
             raise ValidationError('The search is empty', code='empty_search')
 
 
@@ -51,8 +63,6 @@ class CustomerQuestionForm(forms.Form):
 
 
 class DegreeOfSeparationSearchForm(forms.Form):
-    author_choices = [(f'{i[0]}_{i[1]}', f'{i[0]} {i[1]}') for i in Author.objects.values_list(
-        'first_name', 'last_name').order_by('last_name').distinct()]
     author = forms.ChoiceField(choices=author_choices)
-    degree_of_separation = forms.ChoiceField(choices=[(1, 1), (2, 2)])
+    degree_of_separation = forms.IntegerField(min_value=1, initial=1)
 
@@ -0,0 +1,134 @@
+from array import array
+from collections import defaultdict
+
+from .caching import get_version, bump_version, AUTHOR_VERSION
+from .models import Author
+
+
+# Co-authorship graph. Authors, identified by first and last name, are numbered from 0 and two authors are adjacent
+# when they wrote a book together. Each author's neighbors are kept in an array of author numbers, so the graph
+# stays compact and new authors can be linked in without a rebuild.
+class CoAuthorGraph:
+    def __init__(self):
+        self.names = []
+        self.numbers = {}
+        self.adjacency = []
+        self.isbns = []
+        self.book_authors = defaultdict(list)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_author(self, isbn, first_name, last_name):
+        name = (first_name, last_name)
+        number = self.numbers.get(name)
+        if number is None:
+            number = len(self.names)
+            self.numbers[name] = number
+            self.names.append(name)
+            self.adjacency.append(array('I'))
+            self.isbns.append([])
+        elif isbn in self.isbns[number]:
+            return
+        for co_author in self.book_authors[isbn]:
+            if co_author not in self.adjacency[number]:
+                self.adjacency[number].append(co_author)
+                self.adjacency[co_author].append(number)
+        self.book_authors[isbn].append(number)
+        self.isbns[number].append(isbn)
+
+    # the authors exactly `degree` co-authorships away from an author, as names
+    def authors_at_degree(self, name, degree):
+        source = self.numbers.get(name)
+        if source is None or degree < 1:
+            return []
+        seen = {source}
+        frontier = [source]
+        for _ in range(degree):
+            next_frontier = []
+            for number in frontier:
+                for neighbor in self.adjacency[number]:
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+            if not frontier:
+                break
+        return [self.names[number] for number in frontier]
+
+    # the names along a shortest chain of co-authorships between two authors, or None if they are not connected
+    # searches from both ends at once, always growing the smaller frontier
+    def shortest_path(self, start, end):
+        source, target = self.numbers.get(start), self.numbers.get(end)
+        if source is None or target is None:
+            return None
+        forward, backward = {source: None}, {target: None}
+        forward_frontier, backward_frontier = [source], [target]
+        meeting = source if source == target else None
+        while meeting is None and forward_frontier and backward_frontier:
+            if len(forward_frontier) > len(backward_frontier):
+                forward, backward = backward, forward
+                forward_frontier, backward_frontier = backward_frontier, forward_frontier
+            next_frontier = []
+            for number in forward_frontier:
+                for neighbor in self.adjacency[number]:
+                    if neighbor not in forward:
+                        forward[neighbor] = number
+                        next_frontier.append(neighbor)
+                        if neighbor in backward:
+                            meeting = neighbor
+                            break
+                if meeting is not None:
+                    break
+            forward_frontier = next_frontier
+        if meeting is None:
+            return None
+        if source not in forward:
+            forward, backward = backward, forward
+        path = []
+        number = meeting
+        while number is not None:
+            path.append(number)
+            number = forward[number]
+        path.reverse()
+        number = backward[meeting]
+        while number is not None:
+            path.append(number)
+            number = backward[number]
+        return [self.names[number] for number in path]
+
+    # isbns of the books written by an author
+    def books_of(self, name):
+        number = self.numbers.get(name)
+        return [] if number is None else list(self.isbns[number])
+
+
+_graph = None
+_graph_version = None
+
+
+# the co-author graph of this process, rebuilt when authors were changed or deleted in any process
+def get_coauthor_graph():
+    global _graph, _graph_version
+    version = get_version(AUTHOR_VERSION)
+    if _graph is None or _graph_version != version:
+        graph = CoAuthorGraph()
+        for isbn, first_name, last_name in Author.objects.values_list('isbn', 'first_name', 'last_name').iterator():
+            graph.add_author(isbn, first_name, last_name)
+        _graph, _graph_version = graph, version
+    return _graph
+
+
+# link a new author into the graph of this process, other processes rebuild theirs
+def author_added(author):
+    global _graph_version
+    up_to_date = _graph is not None and _graph_version == get_version(AUTHOR_VERSION)
+    bump_version(AUTHOR_VERSION)
+    if up_to_date:
+        _graph.add_author(author.isbn_id, author.first_name, author.last_name)
+        _graph_version = get_version(AUTHOR_VERSION)
+
+
+# edges cannot be removed from the arrays, so any other change rebuilds the graph everywhere
+def authors_changed():
+    bump_version(AUTHOR_VERSION)
@@ -0,0 +1,158 @@
+import logging
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+# what is measured for every request, in the order samples are stored
+METRICS = ('queries', 'db_time', 'template_time', 'wall_time')
+METRIC_HELP = {
+    'queries': 'Database queries per request',
+    'db_time': 'Seconds spent in the database per request',
+    'template_time': 'Seconds spent rendering templates per request',
+    'wall_time': 'Seconds spent handling the request',
+}
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+# the measurement of the request being handled, templates add their render time to it
+current_sample = ContextVar('current_sample', default=None)
+
+
+# raised when a view issues more queries than its budget in QUERY_BUDGETS and QUERY_BUDGETS_RAISE is set
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# the last INSTRUMENTATION_SAMPLES samples of every url name, kept per process
+class ViewStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(self.new_samples)
+
+    @staticmethod
+    def new_samples():
+        return deque(maxlen=getattr(settings, 'INSTRUMENTATION_SAMPLES', 1000))
+
+    def record(self, view, sample):
+        with self.lock:
+            self.samples[view].append(tuple(sample[metric] for metric in METRICS))
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    # {view: {metric: {'count', 'sum', quantile: value}}}
+    def summary(self):
+        with self.lock:
+            samples = {view: list(view_samples) for view, view_samples in self.samples.items()}
+        summary = {}
+        for view, view_samples in sorted(samples.items()):
+            summary[view] = {}
+            for i, metric in enumerate(METRICS):
+                values = sorted(sample[i] for sample in view_samples)
+                summary[view][metric] = {'count': len(values), 'sum': sum(values)}
+                for quantile in QUANTILES:
+                    summary[view][metric][quantile] = percentile(values, quantile)
+        return summary
+
+
+# nearest-rank percentile of sorted values
+def percentile(values, quantile):
+    if not values:
+        return 0
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+
+view_stats = ViewStats()
+
+
+# the summary in the Prometheus text exposition format
+def prometheus_text(summary):
+    lines = []
+    for metric in METRICS:
+        name = f'bookstore_view_{metric}'
+        lines.append(f'# HELP {name} {METRIC_HELP[metric]}')
+        lines.append(f'# TYPE {name} summary')
+        for view, metrics in summary.items():
+            for quantile in QUANTILES:
+                lines.append(f'{name}{{view="{view}",quantile="{quantile}"}} {metrics[metric][quantile]}')
+            lines.append(f'{name}_sum{{view="{view}"}} {metrics[metric]["sum"]}')
+            lines.append(f'{name}_count{{view="{view}"}} {metrics[metric]["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+# counts the queries and the time they take on every connection while a request is handled
+class QueryTimer:
+    def __init__(self, sample):
+        self.sample = sample
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sample['queries'] += 1
+            self.sample['db_time'] += time.perf_counter() - start
+
+
+# records query count, database time, template time and wall time per url name
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample = dict.fromkeys(METRICS, 0)
+        token = current_sample.set(sample)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(QueryTimer(sample)))
+                response = self.get_response(request)
+        finally:
+            sample['wall_time'] = time.perf_counter() - start
+            current_sample.reset(token)
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unresolved'
+        view_stats.record(view, sample)
+        self.check_budget(view, sample)
+        return response
+
+    @staticmethod
+    def check_budget(view, sample):
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view)
+        if budget is None or sample['queries'] <= budget:
+            return
+        message = f'{view} issued {sample["queries"]} queries, its budget is {budget}'
+        if getattr(settings, 'QUERY_BUDGETS_RAISE', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+# templates of the Django backend that add their render time to the current request's sample
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        sample = current_sample.get()
+        if sample is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample['template_time'] += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from home.models import Book, Author, Customer, BookOrder, BestSeller
+from home.caching import clear_caches
+
+
+# every query on every connection, including the ones worker threads open while it is active, takes `delay`
+# seconds longer, as if the database were on a slow network
+@contextmanager
+def slow_database(delay):
+    def slow(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def add_delay(sender, connection, **kwargs):
+        if slow not in connection.execute_wrappers:
+            connection.execute_wrappers.append(slow)
+
+    connection_created.connect(add_delay)
+    for connection in connections.all():
+        add_delay(None, connection)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(add_delay)
+        for connection in connections.all():
+            if slow in connection.execute_wrappers:
+                connection.execute_wrappers.remove(slow)
+        # worker threads keep their connections, which still sleep
+        connections.close_all()
+
+
+# the keyword arguments of a test client request; forms are posted urlencoded by both clients, as the multipart
+# bodies the async client builds cannot be read back in Django 3.2
+def request_arguments(method, data):
+    if method == 'post':
+        return {'data': urlencode(data), 'content_type': 'application/x-www-form-urlencoded'}
+    return {'data': data}
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of one WSGI worker running the synchronous views with one ASGI worker running ' \
+           'the async views, with a simulated slow database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=10, help='milliseconds added to every query')
+        parser.add_argument('--requests', type=int, default=50, help='requests per scenario and server')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='requests the ASGI worker handles at the same time')
+        parser.add_argument('--output', help='also write the results to this JSON file')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('At least one request at a time is needed')
+        top = BookOrder.objects.values('username').annotate(orders=Count('order_number')).order_by('-orders').first()
+        customer = Customer.objects.filter(pk=top['username']).first() if top else Customer.objects.first()
+        if customer is None or not Book.objects.exists():
+            raise CommandError('The database has no customers or books, run generate_synthetic_data first')
+        popular = list(BestSeller.objects.order_by('-total_quantity').values_list('isbn', flat=True)[:100]) or \
+            list(Book.objects.values_list('isbn', flat=True)[:100])
+        titles = [title.split()[0] for title in Book.objects.filter(isbn__in=popular).values_list('title', flat=True)]
+        author = Author.objects.filter(isbn__in=popular).values_list('first_name', 'last_name').first()
+
+        # name: (synchronous url name, async url name, method, arguments, data), arguments and data are callables
+        # so that requests vary
+        scenarios = {
+            'home': ('home', 'async_home', 'get', lambda: [], lambda: None),
+            'book_detail': ('book_detail', 'async_book_detail', 'get', lambda: [rng.choice(popular)], lambda: None),
+            'book_search': ('book_search', 'async_book_search', 'get', lambda: [],
+                            lambda: {'book_search': '', 'query': rng.choice(titles)}),
+            'degree_of_separation_search': ('degree_of_separation_search', 'async_degree_of_separation_search',
+                                            'post', lambda: [],
+                                            lambda: {'author': f'{author[0]}_{author[1]}' if author else '',
+                                                     'degree_of_separation': 2}),
+        }
+
+        results = {}
+        latency = options['latency'] / 1000
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], DEBUG=False), \
+                slow_database(latency):
+            for name, (sync_name, async_name, method, arguments, data) in scenarios.items():
+                requests = [(arguments(), data()) for _ in range(options['requests'])]
+                wsgi = self.run_wsgi(customer, sync_name, method, requests)
+                asgi = self.run_asgi(customer, async_name, method, requests, options['concurrency'])
+                results[name] = {'wsgi': wsgi, 'asgi': asgi,
+                                 'gain': round(asgi['requests_per_second'] / wsgi['requests_per_second'], 2)}
+                self.stdout.write(f'{name:<28} WSGI {wsgi["requests_per_second"]:>7.1f} req/s '
+                                  f'p50 {wsgi["p50_ms"]:>7.1f}ms   ASGI {asgi["requests_per_second"]:>7.1f} req/s '
+                                  f'p50 {asgi["p50_ms"]:>7.1f}ms   x{results[name]["gain"]}')
+
+        if options['output']:
+            report = {'latency_ms': options['latency'], 'requests': options['requests'],
+                      'concurrency': options['concurrency'], 'views': results}
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    # one request at a time, as a synchronous worker serves them
+    @staticmethod
+    def run_wsgi(customer, url_name, method, requests):
+        client = Client()
+        client.force_login(customer)
+        clear_caches()
+        latencies = []
+        start = time.perf_counter()
+        for arguments, data in requests:
+            request_start = time.perf_counter()
+            response = getattr(client, method)(reverse(url_name, args=arguments),
+                                                   **request_arguments(method, data))
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {url_name} returned {response.status_code}')
+            latencies.append((time.perf_counter() - request_start) * 1000)
+        elapsed = time.perf_counter() - start
+        return {'requests_per_second': round(len(requests) / elapsed, 2),
+                'p50_ms': round(statistics.median(latencies), 3)}
+
+    # up to `concurrency` requests at a time on one event loop, as an ASGI worker serves them
+    @staticmethod
+    def run_asgi(customer, url_name, method, requests, concurrency):
+        client = AsyncClient()
+        client.force_login(customer)
+        clear_caches()
+        latencies = []
+
+        async def serve(queue):
+            while queue:
+                arguments, data = queue.pop()
+                request_start = time.perf_counter()
+                response = await getattr(client, method)(reverse(url_name, args=arguments),
+                                                   **request_arguments(method, data))
+                if response.status_code >= 400:
+                    raise CommandError(f'{method.upper()} {url_name} returned {response.status_code}')
+                latencies.append((time.perf_counter() - request_start) * 1000)
+
+        async def serve_all():
+            queue = list(reversed(requests))
+            await asyncio.gather(*[serve(queue) for _ in range(concurrency)])
+
+        start = time.perf_counter()
+        asyncio.run(serve_all())
+        elapsed = time.perf_counter() - start
+        return {'requests_per_second': round(len(requests) / elapsed, 2),
+                'p50_ms': round(statistics.median(latencies), 3)}
@@ -0,0 +1,44 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.graph import CoAuthorGraph
+
+
+class Command(BaseCommand):
+    help = 'Time co-author graph construction and searches on a synthetic graph'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=100_000)
+        parser.add_argument('--books', type=int, default=150_000)
+        parser.add_argument('--max-authors-per-book', type=int, default=4)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        names = [(f'First{i}', f'Last{i}') for i in range(options['authors'])]
+        graph = CoAuthorGraph()
+        start = time.perf_counter()
+        for book in range(options['books']):
+            for name in rng.sample(names, rng.randint(1, options['max_authors_per_book'])):
+                graph.add_author(f'{book:013d}', *name)
+        edges = sum(len(neighbors) for neighbors in graph.adjacency) // 2
+        self.stdout.write(f'built {len(graph)} authors and {edges} edges in {time.perf_counter() - start:.2f}s')
+
+        for degree in (1, 2, 3):
+            self.report(f'degree {degree}', options['queries'],
+                        lambda: graph.authors_at_degree(rng.choice(names), degree))
+        self.report('shortest path', options['queries'],
+                    lambda: graph.shortest_path(rng.choice(names), rng.choice(names)))
+
+    def report(self, label, queries, query):
+        latencies = []
+        for _ in range(queries):
+            start = time.perf_counter()
+            query()
+            latencies.append((time.perf_counter() - start) * 1_000_000)
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(f'{label:>14}: p50 {percentiles[49]:>9.0f}us p95 {percentiles[94]:>9.0f}us')
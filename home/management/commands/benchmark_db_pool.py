@@ -0,0 +1,145 @@
+import json
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from home.db_backends import PooledDatabaseMixin, close_pools, get_pool
+from home.models import Customer, ShoppingCart
+
+
+# every new connection takes `delay` seconds longer to open, as the TCP handshake, TLS and authentication with a
+# MySQL server do; connections taken from a pool are not delayed
+@contextmanager
+def slow_connects(wrapper_class, delay):
+    open_connection = wrapper_class.open_connection
+    opened = []
+
+    def slow(self, conn_params):
+        time.sleep(delay)
+        opened.append(1)
+        return open_connection(self, conn_params)
+
+    wrapper_class.open_connection = slow
+    try:
+        yield opened
+    finally:
+        wrapper_class.open_connection = open_connection
+
+
+# the connection settings of a run, restored afterwards; the settings dict is shared by the wrappers of every thread
+@contextmanager
+def database_settings(**options):
+    settings_dict = connections['default'].settings_dict
+    saved = {name: settings_dict.get(name) for name in options}
+    connections.close_all()
+    settings_dict.update(options)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        close_pools()
+        settings_dict.update(saved)
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of a threaded server opening a database connection per request, keeping ' \
+           'persistent connections and sharing a connection pool, with a simulated connection setup cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connect-latency', type=float, default=5,
+                            help='milliseconds added to opening every connection')
+        parser.add_argument('--threads', type=int, default=8, help='server threads handling requests')
+        parser.add_argument('--requests', type=int, default=50, help='requests per thread')
+        parser.add_argument('--pool-size', type=int, default=4)
+        parser.add_argument('--pool-overflow', type=int, default=4)
+        parser.add_argument('--output', help='also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        wrapper_class = type(connections['default'])
+        if not issubclass(wrapper_class, PooledDatabaseMixin):
+            raise CommandError('The default database does not use a home.db_backends engine')
+        if options['threads'] < 1 or options['requests'] < 1:
+            raise CommandError('At least one thread and request are needed')
+        top = ShoppingCart.objects.values('username').annotate(books=Count('isbn')).order_by('-books').first()
+        customer = Customer.objects.filter(pk=top['username']).first() if top else Customer.objects.first()
+        if customer is None:
+            raise CommandError('The database has no customers, run generate_synthetic_data first')
+
+        pool = {'SIZE': options['pool_size'], 'OVERFLOW': options['pool_overflow'], 'TIMEOUT': 30}
+        # name: database settings
+        modes = {
+            'per_request': {'CONN_MAX_AGE': 0, 'POOL': None},
+            'persistent': {'CONN_MAX_AGE': 60, 'POOL': None},
+            'pooled': {'CONN_MAX_AGE': 0, 'POOL': pool},
+        }
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], DEBUG=False), \
+                slow_connects(wrapper_class, options['connect_latency'] / 1000) as opened:
+            for name, database_options in modes.items():
+                with database_settings(HEALTH_CHECKS=True, **database_options):
+                    opened.clear()
+                    results[name] = self.run(customer, options['threads'], options['requests'])
+                    results[name]['connections_opened'] = len(opened)
+                    if database_options['POOL']:
+                        results[name]['pool'] = get_pool(connections['default'].settings_dict).stats()
+                self.stdout.write(f'{name:<12} {results[name]["requests_per_second"]:>8.1f} req/s '
+                                  f'p50 {results[name]["p50_ms"]:>7.2f}ms '
+                                  f'{results[name]["connections_opened"]:>5} connections opened')
+
+        if options['output']:
+            report = {'connect_latency_ms': options['connect_latency'], 'threads': options['threads'],
+                      'requests': options['requests'], 'modes': results}
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    # every thread requests the shopping cart, a short view, `requests` times
+    @staticmethod
+    def run(customer, threads, requests):
+        url = reverse('shopping_cart')
+        clients = []
+        for _ in range(threads):
+            client = Client()
+            client.force_login(customer)
+            clients.append(client)
+        connections.close_all()
+        latencies = []
+        errors = []
+
+        def serve(client):
+            try:
+                for _ in range(requests):
+                    request_start = time.perf_counter()
+                    # the test client leaves connections open, a server checks them when every request starts and
+                    # finishes
+                    close_old_connections()
+                    response = client.get(url)
+                    close_old_connections()
+                    if response.status_code >= 400:
+                        raise CommandError(f'GET {url} returned {response.status_code}')
+                    latencies.append((time.perf_counter() - request_start) * 1000)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=serve, args=(client,)) for client in clients]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise errors[0]
+        return {'requests_per_second': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(statistics.median(latencies), 3)}
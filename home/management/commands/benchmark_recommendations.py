@@ -0,0 +1,40 @@
+import random
+import time
+from collections import defaultdict
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from home.recommendations import compute_neighbors, NEIGHBOR_COUNT
+
+
+class Command(BaseCommand):
+    help = 'Time the recommendation build against synthetic order histories of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help='numbers of order lines to benchmark')
+        parser.add_argument('--books', type=int, default=50_000)
+        parser.add_argument('--lines-per-customer', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"order lines":>12} {"customers":>10} {"seconds":>9} {"lines/s":>10}')
+        for lines in options['lines']:
+            purchases = self.synthetic_purchases(lines, options['books'], options['lines_per_customer'],
+                                                 options['seed'])
+            start = time.perf_counter()
+            compute_neighbors(purchases, k=NEIGHBOR_COUNT)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{lines:>12} {len(purchases):>10} {elapsed:>9.3f} {lines / elapsed:>10.0f}')
+
+    # popularity follows a power law, as real sales do
+    @staticmethod
+    def synthetic_purchases(lines, books, lines_per_customer, seed):
+        rng = random.Random(seed)
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(books)))
+        isbns = rng.choices(range(books), cum_weights=cum_weights, k=lines)
+        purchases = defaultdict(set)
+        for i, isbn in enumerate(isbns):
+            purchases[i // lines_per_customer].add(f'{isbn:013d}')
+        return purchases
@@ -0,0 +1,50 @@
+import random
+import statistics
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from home.search import InvertedIndex
+
+
+class Command(BaseCommand):
+    help = 'Time the fallback search index over a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1_000_000)
+        parser.add_argument('--vocabulary', type=int, default=50_000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # word frequencies follow a power law, as in real titles
+        vocabulary = [self.word(rng) for _ in range(options['vocabulary'])]
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+        def text(k):
+            return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=k))
+
+        index = InvertedIndex()
+        start = time.perf_counter()
+        for i in range(options['books']):
+            index.add(f'{i:013d}', f'{text(4)} {text(2)} {text(2)} {text(2)} {text(3)}')
+        build_time = time.perf_counter() - start
+        self.stdout.write(f'indexed {len(index)} books in {build_time:.1f}s')
+
+        queries = [text(rng.randint(1, 3)) for _ in range(options['queries'])]
+        # partial last word, as typed in a search box
+        queries += [query[:max(1, len(query) - 2)] for query in queries[:len(queries) // 2]]
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, limit=20)
+            latencies.append((time.perf_counter() - start) * 1000)
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(f'{len(queries)} queries: p50 {percentiles[49]:.2f}ms p95 {percentiles[94]:.2f}ms '
+                          f'max {max(latencies):.2f}ms')
+
+    @staticmethod
+    def word(rng):
+        return ''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(3, 9)))
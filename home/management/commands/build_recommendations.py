@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from home.recommendations import build_neighbors, NEIGHBOR_COUNT
+
+
+class Command(BaseCommand):
+    help = 'Fold the orders placed since the last build into the book recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='recompute every book from the full order history')
+        parser.add_argument('--neighbors', type=int, default=NEIGHBOR_COUNT, help='neighbors kept per book')
+
+    def handle(self, *args, **options):
+        count = build_neighbors(full=options['full'], k=options['neighbors'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the neighbors of {count} books'))
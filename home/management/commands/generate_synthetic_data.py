@@ -0,0 +1,233 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from home.caching import bump_version, CATALOG_VERSION
+from home.graph import authors_changed
+from home.models import Book, Author, Customer, BookOrder, BookInOrder, Comment, CommentVote, TrustedCustomer, \
+    UntrustedCustomer
+from home.utils import USEFULNESS_WEIGHTS, RATING_COUNT_FIELDS
+
+LANGUAGES = ['English', 'English', 'English', 'Spanish', 'French', 'German', 'Chinese', 'Japanese']
+# every synthetic customer logs in with this password
+PASSWORD = 'password'
+
+
+# insert rows with a raw executemany, for models bulk_create cannot write: Customer inherits from User,
+# and BookOrder and Comment would get the current time instead of the generated one
+def insert_rows(model, fields, rows):
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+# the next free value of an integer primary key, synthetic rows get explicit keys so that lines can refer to them
+def next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a seeded synthetic catalog, customers, orders, comments and trust edges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1_000_000)
+        parser.add_argument('--authors', type=int, default=300_000, help='distinct people writing the books')
+        parser.add_argument('--customers', type=int, default=100_000)
+        parser.add_argument('--orders', type=int, default=500_000)
+        parser.add_argument('--comments', type=int, default=1_000_000)
+        parser.add_argument('--votes-per-comment', type=int, default=2)
+        parser.add_argument('--trust-edges', type=int, default=200_000)
+        parser.add_argument('--days', type=int, default=365, help='orders and comments are spread over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='do not rebuild best sellers, sales rollups, aggregates, the search index and '
+                                 'recommendations')
+
+    def handle(self, *args, **options):
+        if Customer.objects.filter(username='synthetic0').exists():
+            raise CommandError('Synthetic data has already been generated in this database')
+        if options['customers'] < 2 or options['books'] < 1 or options['authors'] < 1:
+            raise CommandError('At least one book and author and two customers are needed')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.days = options['days']
+        self.vocabulary = [self.word() for _ in range(20_000)]
+        # words, books and authors are popular following a power law
+        self.word_weights = list(accumulate(1 / (rank + 1) for rank in range(len(self.vocabulary))))
+
+        prices = self.generate_books(options['books'])
+        isbns = list(prices)
+        book_weights = list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(isbns))))
+        self.generate_authors(isbns, options['authors'])
+        customers = self.generate_customers(options['customers'])
+        self.generate_orders(isbns, book_weights, prices, customers, options['orders'])
+        self.generate_comments(isbns, book_weights, customers, options['comments'], options['votes_per_comment'])
+        self.generate_trust(customers, options['trust_edges'])
+
+        bump_version(CATALOG_VERSION)
+        authors_changed()
+        if not options['skip_derived']:
+            for command, *arguments in [('rebuild_best_sellers',), ('rebuild_sales_rollups',),
+                                        ('reconcile_aggregates',), ('rebuild_search_index',),
+                                        ('build_recommendations', '--full')]:
+                call_command(command, *arguments, stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Generated the synthetic data'))
+
+    def word(self):
+        return ''.join(self.rng.choices('abcdefghijklmnopqrstuvwxyz', k=self.rng.randint(3, 9)))
+
+    def text(self, k):
+        return ' '.join(self.rng.choices(self.vocabulary, cum_weights=self.word_weights, k=k))[:100]
+
+    def moment(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.days * 24 * 3600))
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield range(start, min(start + self.batch_size, total))
+
+    def generate_books(self, count):
+        rng = self.rng
+        publishers = [self.text(2).title() for _ in range(max(1, count // 1000))]
+        subjects = [self.text(1).title() for _ in range(200)]
+        prices = {}
+        for batch in self.batches(count):
+            books = [Book(
+                isbn=f'9{i:012d}', title=self.text(rng.randint(1, 6)).title(), publisher=rng.choice(publishers),
+                publication_date=date(1950, 1, 1) + timedelta(days=rng.randrange(27000)),
+                subject=rng.choice(subjects), keywords=self.text(3), language=rng.choice(LANGUAGES),
+                page_count=rng.randint(40, 1200), stock_level=rng.randint(0, 500),
+                price=Decimal(rng.randint(199, 19999)) / 100) for i in batch]
+            Book.objects.bulk_create(books)
+            prices.update((book.isbn, book.price) for book in books)
+        self.stdout.write(f'{count} books')
+        # isbn: price, in the order the books were generated
+        return prices
+
+    def generate_authors(self, isbns, people):
+        rng = self.rng
+        first_names = [self.word().title() for _ in range(max(1, people // 100))]
+        names = [(rng.choice(first_names), f'{self.word().title()}{i}') for i in range(people)]
+        weights = list(accumulate(1 / (rank + 1) ** 0.6 for rank in range(people)))
+        count = 0
+        for batch in self.batches(len(isbns)):
+            authors = []
+            for i in batch:
+                # one to three distinct co-authors per book, sets are sorted so that the seed decides everything
+                picked = sorted(set(rng.choices(names, cum_weights=weights, k=rng.choice([1, 1, 2, 3]))))
+                for first_name, last_name in picked:
+                    authors.append(Author(isbn_id=isbns[i], first_name=first_name, last_name=last_name))
+            Author.objects.bulk_create(authors)
+            count += len(authors)
+        self.stdout.write(f'{count} authors')
+
+    def generate_customers(self, count):
+        rng = self.rng
+        password = make_password(PASSWORD)
+        start = next_pk(User)
+        joined = self.now - timedelta(days=self.days)
+        # the maintained aggregates start at their defaults and are recomputed by reconcile_aggregates
+        aggregates = [field for field in Customer._meta.local_concrete_fields if not field.editable and
+                      not field.primary_key]
+        for batch in self.batches(count):
+            with transaction.atomic():
+                User.objects.bulk_create([User(
+                    pk=start + i, username=f'synthetic{i}', password=password, first_name=self.word().title(),
+                    last_name=self.word().title(), date_joined=joined) for i in batch])
+                insert_rows(Customer, ['user_ptr', 'address', 'phone_number', 'banned',
+                                       *[field.name for field in aggregates]],
+                            [(start + i, self.text(3), f'{rng.randrange(10 ** 10):010d}', rng.random() < 0.01,
+                              *[field.get_default() for field in aggregates]) for i in batch])
+        self.stdout.write(f'{count} customers')
+        return list(range(start, start + count))
+
+    def generate_orders(self, isbns, book_weights, prices, customers, count):
+        rng = self.rng
+        start = next_pk(BookOrder)
+        lines_count = 0
+        for batch in self.batches(count):
+            orders, lines = [], []
+            for i in batch:
+                picked = set(rng.choices(isbns, cum_weights=book_weights, k=rng.choice([1, 1, 1, 2, 2, 3, 4])))
+                order_lines = [(isbn, rng.choice([1, 1, 1, 2, 3])) for isbn in sorted(picked)]
+                lines += [BookInOrder(order_number_id=start + i, isbn_id=isbn, count=quantity)
+                          for isbn, quantity in order_lines]
+                orders.append((start + i, rng.choice(customers), order_lines))
+            with transaction.atomic():
+                insert_rows(BookOrder, ['order_number', 'username', 'order_time', 'total_price'], [
+                    (order_number, customer, connection.ops.adapt_datetimefield_value(self.moment()),
+                     connection.ops.adapt_decimalfield_value(
+                         sum(prices[isbn] * quantity for isbn, quantity in order_lines), 10, 2))
+                    for order_number, customer, order_lines in orders])
+                BookInOrder.objects.bulk_create(lines)
+            lines_count += len(lines)
+        self.stdout.write(f'{count} orders with {lines_count} lines')
+
+    def generate_comments(self, isbns, book_weights, customers, count, votes_per_comment):
+        rng = self.rng
+        start = next_pk(Comment)
+        comment_id, comments, votes = start, [], []
+
+        def flush():
+            with transaction.atomic():
+                insert_rows(Comment, ['id', 'username', 'isbn', 'score', 'comment_text', 'time',
+                                      *RATING_COUNT_FIELDS.values(), 'usefulness_score'], comments)
+                CommentVote.objects.bulk_create(votes)
+            comments.clear()
+            votes.clear()
+
+        for i, customer in enumerate(customers):
+            # each customer comments on a book at most once, so a customer cannot write more comments than there are
+            # books; popular books are drawn again until enough distinct ones are found, within a limit
+            k = min(count // len(customers) + (i < count % len(customers)), len(isbns))
+            picked = set()
+            for _ in range(k * 20):
+                if len(picked) == k:
+                    break
+                picked.update(rng.choices(isbns, cum_weights=book_weights, k=k - len(picked)))
+            for isbn in sorted(picked):
+                counts = dict.fromkeys(USEFULNESS_WEIGHTS, 0)
+                for voter in rng.sample(customers, min(votes_per_comment + 1, len(customers))):
+                    if voter != customer and sum(counts.values()) < votes_per_comment:
+                        rating = rng.choice(list(USEFULNESS_WEIGHTS))
+                        counts[rating] += 1
+                        votes.append(CommentVote(comment_id=comment_id, username_id=voter, rating=rating))
+                # scores are recomputed by reconcile_aggregates
+                comments.append((comment_id, customer, isbn, rng.choices(range(1, 11), weights=range(1, 11))[0],
+                                 self.text(12), connection.ops.adapt_datetimefield_value(self.moment()),
+                                 *[counts[rating] for rating in RATING_COUNT_FIELDS], 0.0))
+                comment_id += 1
+            if len(comments) >= self.batch_size:
+                flush()
+        flush()
+        self.stdout.write(f'{comment_id - start} comments')
+
+    def generate_trust(self, customers, count):
+        rng = self.rng
+        seen = set()
+        trusts, untrusts = [], []
+        for _ in range(count):
+            customer, target = rng.sample(customers, 2)
+            if (customer, target) in seen:
+                continue
+            seen.add((customer, target))
+            if rng.random() < 0.7:
+                trusts.append(TrustedCustomer(username_id=customer, trusted_username_id=target))
+            else:
+                untrusts.append(UntrustedCustomer(username_id=customer, untrusted_username_id=target))
+        TrustedCustomer.objects.bulk_create(trusts, batch_size=self.batch_size)
+        UntrustedCustomer.objects.bulk_create(untrusts, batch_size=self.batch_size)
+        self.stdout.write(f'{len(trusts)} trust and {len(untrusts)} untrust edges')
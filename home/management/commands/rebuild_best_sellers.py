@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from home.caching import bump_version, SALES_VERSION
+from home.models import BestSeller, BookInOrder
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the best seller table from the full order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        totals = BookInOrder.objects.values('isbn').annotate(total_quantity=Sum('count')).order_by()
+        with transaction.atomic():
+            BestSeller.objects.all().delete()
+            BestSeller.objects.bulk_create(
+                (BestSeller(isbn_id=row['isbn'], total_quantity=row['total_quantity']) for row in totals.iterator()),
+                batch_size=options['batch_size'])
+        bump_version(SALES_VERSION)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {BestSeller.objects.count()} best seller rows'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from home.caching import bump_version, SALES_VERSION
+from home.models import DailyBookSales, DailyAuthorSales, DailyPublisherSales
+from home.utils import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily book, author and publisher sales from the full order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_daily_sales(batch_size=options['batch_size'])
+        # the cached book reports are stale
+        bump_version(SALES_VERSION)
+        for model in (DailyBookSales, DailyAuthorSales, DailyPublisherSales):
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {model.objects.count()} {model._meta.verbose_name} rows'))
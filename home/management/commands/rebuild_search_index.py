@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from home.models import BookSearchDocument
+from home.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute the search documents of every book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {BookSearchDocument.objects.count()} books'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from home.caching import bump_version, CATALOG_VERSION
+from home.utils import reconcile_book_ratings, reconcile_usefulness_scores, reconcile_customer_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recompute the maintained aggregates from their source rows'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            books = reconcile_book_ratings()
+            comments = reconcile_usefulness_scores()
+            # after the usefulness scores, which the customer aggregates sum
+            customers = reconcile_customer_aggregates()
+        # the scores and comment order shown on every book page may have changed
+        bump_version(CATALOG_VERSION)
+        self.stdout.write(self.style.SUCCESS(f'Reconciled the ratings of {books} books'))
+        self.stdout.write(self.style.SUCCESS(f'Reconciled the usefulness scores of {comments} comments'))
+        self.stdout.write(self.style.SUCCESS(f'Reconciled the trust and usefulness of {customers} customers'))
@@ -0,0 +1,158 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from home.instrumentation import QueryTimer
+from home.models import Book, Author, Customer, BookOrder, Comment, BestSeller
+from home.utils import add_to_cart
+
+
+# the commit the benchmark ran on, so that result files can be compared across commits
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Drive every view with the test client and write query counts, latencies and memory to a JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='timed requests per scenario')
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['requests'] < 1:
+            raise CommandError('At least one request per scenario is needed')
+        # the benchmark customer is the one with the most orders, its cart is filled if it is empty
+        top = BookOrder.objects.values('username').annotate(orders=Count('order_number')).order_by('-orders').first()
+        customer = Customer.objects.filter(pk=top['username']).first() if top else Customer.objects.first()
+        if customer is None or not Book.objects.exists():
+            raise CommandError('The database has no customers or books, run generate_synthetic_data first')
+        if not customer.shoppingcart_set.exists():
+            for isbn in BestSeller.objects.order_by('-total_quantity').values_list('isbn', flat=True)[:3]:
+                add_to_cart(customer, isbn)
+        staff = User.objects.filter(is_superuser=True).first() or \
+            User.objects.create_superuser('benchmark_admin', password='password')
+
+        popular = list(BestSeller.objects.order_by('-total_quantity').values_list('isbn', flat=True)[:100]) or \
+            list(Book.objects.values_list('isbn', flat=True)[:100])
+        titles = [title.split()[0] for title in Book.objects.filter(isbn__in=popular).values_list('title', flat=True)]
+        author = Author.objects.filter(isbn__in=popular).values_list('first_name', 'last_name').first()
+        commented = Comment.objects.values_list('isbn', flat=True).order_by('-id').first() or popular[0]
+
+        def search(**params):
+            return reverse('book_search') + '?book_search=&' + '&'.join(f'{key}={value}' for key, value in
+                                                                        params.items())
+
+        # name: (user, method, url, data), urls and data are callables so that requests vary
+        scenarios = {
+            'home anonymous': (None, 'get', lambda: reverse('home'), None),
+            'home': (customer, 'get', lambda: reverse('home'), None),
+            'book_search form': (None, 'get', lambda: reverse('book_search'), None),
+            'book_search title': (customer, 'get', lambda: search(title=rng.choice(titles)), None),
+            'book_search query': (customer, 'get', lambda: search(query=rng.choice(titles)), None),
+            'book_search score': (customer, 'get', lambda: search(query=rng.choice(titles), sort_by='Average Score'),
+                                  None),
+            'book_search trusted score': (customer, 'get', lambda: search(query=rng.choice(titles),
+                                                                          sort_by='Average Trusted User Score'), None),
+            'book_detail': (customer, 'get', lambda: reverse('book_detail', args=[rng.choice(popular)]), None),
+            'book_detail commented': (customer, 'get', lambda: reverse('book_detail', args=[commented]), None),
+            'shopping_cart': (customer, 'get', lambda: reverse('shopping_cart'), None),
+            'my_account': (customer, 'get', lambda: reverse('my_account'), None),
+            'my_order': (customer, 'get', lambda: reverse('my_order'), None),
+            'my_question': (customer, 'get', lambda: reverse('my_question'), None),
+            'sign_up': (None, 'get', lambda: reverse('sign_up'), None),
+            'login': (None, 'get', lambda: reverse('login'), None),
+            'degree_of_separation_search form': (customer, 'get', lambda: reverse('degree_of_separation_search'),
+                                                 None),
+            'degree_of_separation_search': (customer, 'post', lambda: reverse('degree_of_separation_search'),
+                                            {'author': f'{author[0]}_{author[1]}' if author else '',
+                                             'degree_of_separation': 2}),
+            'admin_user_report trusted': (staff, 'post', lambda: reverse('admin_user_report'),
+                                          {'number': 10, 'top_trusted': ''}),
+            'admin_user_report useful': (staff, 'post', lambda: reverse('admin_user_report'),
+                                         {'number': 10, 'top_useful': ''}),
+            'admin_book_report books': (staff, 'post', lambda: reverse('admin_book_report'),
+                                        {'number': 10, 'top_books': ''}),
+            'admin_book_report authors': (staff, 'post', lambda: reverse('admin_book_report'),
+                                          {'number': 10, 'top_authors': ''}),
+            'admin_book_report publishers': (staff, 'post', lambda: reverse('admin_book_report'),
+                                             {'number': 10, 'top_publishers': ''}),
+            'admin_view_stats': (staff, 'get', lambda: reverse('admin_view_stats'), None),
+            'admin_cache_stats': (staff, 'get', lambda: reverse('admin_cache_stats'), None),
+        }
+
+        results = {}
+        # the test client talks to 'testserver', and DEBUG would keep every query in memory
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], DEBUG=False):
+            for name, (user, method, url, data) in scenarios.items():
+                results[name] = self.run_scenario(user, method, url, data, options['requests'])
+                self.stdout.write(f'{name:<36} {results[name]["queries"]:>4} queries  '
+                                  f'p50 {results[name]["p50_ms"]:>8.2f}ms  p95 {results[name]["p95_ms"]:>8.2f}ms  '
+                                  f'peak {results[name]["peak_memory_kb"]:>8.1f}kB')
+
+        report = {
+            'commit': current_commit(),
+            'database': connection.vendor,
+            'created': timezone.now().isoformat(),
+            'requests': options['requests'],
+            'rows': {model.__name__: model.objects.count() for model in (Book, Author, Customer, BookOrder, Comment)},
+            'views': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    @staticmethod
+    def run_scenario(user, method, url, data, requests):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+
+        def request(sample):
+            with connection.execute_wrapper(QueryTimer(sample)):
+                response = getattr(client, method)(url(), data)
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {url()} returned {response.status_code}')
+            return response
+
+        # the first request fills the caches, the timed ones show the steady state
+        request(dict.fromkeys(['queries', 'db_time'], 0))
+        latencies, queries, db_times = [], [], []
+        for _ in range(requests):
+            sample = dict.fromkeys(['queries', 'db_time'], 0)
+            start = time.perf_counter()
+            request(sample)
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(sample['queries'])
+            db_times.append(sample['db_time'] * 1000)
+        # memory is measured on a separate request, tracing allocations slows everything down
+        tracemalloc.start()
+        request(dict.fromkeys(['queries', 'db_time'], 0))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        percentiles = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else latencies * 19
+        return {
+            'queries': max(queries),
+            'db_ms': round(statistics.median(db_times), 3),
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(percentiles[18], 3),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
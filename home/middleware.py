@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import router
+from django.utils.functional import SimpleLazyObject
+
+from .caching import USER_TIER
+from .models import Customer
+
+# the columns a Customer adds to its User row, the maintained aggregates are left out since they change without a save
+CUSTOMER_FIELDS = [field.attname for field in Customer._meta.local_concrete_fields
+                   if field.attname != 'user_ptr_id' and field.editable]
+
+
+def customer_key(user_pk):
+    return f'customer:{user_pk}'
+
+
+# forget the cached customer row of a user, called when the Customer is saved or deleted
+def forget_customer(user_pk):
+    caches[USER_TIER].delete(customer_key(user_pk))
+
+
+# the Customer of the logged in user, or None for anonymous users and users that are not customers
+# only the customer's own columns are read, the User columns are taken from request.user which the
+# authentication middleware already loaded; the row is cached for CUSTOMER_CACHE_TIMEOUT seconds
+def get_customer(request):
+    if not hasattr(request, '_cached_customer'):
+        user = request.user
+        if not user.is_authenticated:
+            request._cached_customer = None
+            return None
+        timeout = getattr(settings, 'CUSTOMER_CACHE_TIMEOUT', 0)
+        row = caches[USER_TIER].get(customer_key(user.pk)) if timeout else None
+        if row is None:
+            # False marks a user that is not a customer
+            row = Customer.objects.filter(pk=user.pk).values(*CUSTOMER_FIELDS).first() or False
+            if timeout:
+                caches[USER_TIER].set(customer_key(user.pk), row, timeout=timeout)
+        if row is False:
+            request._cached_customer = None
+        else:
+            values = {field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields}
+            values.update(row, user_ptr_id=user.pk)
+            field_names = [field.attname for field in Customer._meta.concrete_fields if field.attname in values]
+            request._cached_customer = Customer.from_db(
+                router.db_for_read(Customer), field_names, [values[name] for name in field_names])
+    return request._cached_customer
+
+
+# sets request.customer, resolved on first use
+class CustomerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer = SimpleLazyObject(lambda: get_customer(request))
+        return self.get_response(request)
@@ -0,0 +1,35 @@
+# Generated by Django 3.2 on 2026-10-18 11:40
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_best_sellers(apps, schema_editor):
+    BestSeller = apps.get_model('home', 'BestSeller')
+    BookInOrder = apps.get_model('home', 'BookInOrder')
+    totals = BookInOrder.objects.values('isbn').annotate(total_quantity=models.Sum('count')).order_by()
+    BestSeller.objects.bulk_create([BestSeller(isbn_id=row['isbn'], total_quantity=row['total_quantity'])
+                                    for row in totals], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_comment_usefulness_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestSeller',
+            fields=[
+                ('isbn', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='home.book')),
+                ('total_quantity', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bestseller',
+            index=models.Index(fields=['-total_quantity', 'isbn'], name='best seller rank'),
+        ),
+        migrations.RunPython(populate_best_sellers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2 on 2026-10-18 11:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# a copy of home.search.build_document as of this migration, so that later changes to it do not change the migration
+FIELD_WEIGHTS = {'title': 3, 'authors': 2, 'keywords': 2, 'subject': 1, 'publisher': 1}
+
+
+def build_document(book, authors):
+    fields = {'title': book.title,
+              'authors': ' '.join(f'{author.first_name} {author.last_name}' for author in authors),
+              'keywords': book.keywords,
+              'subject': book.subject,
+              'publisher': book.publisher}
+    return ' '.join(' '.join([fields[field]] * weight) for field, weight in FIELD_WEIGHTS.items())
+
+
+def create_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('CREATE FULLTEXT INDEX home_booksearchdocument_text ON home_booksearchdocument (text)')
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('DROP INDEX home_booksearchdocument_text ON home_booksearchdocument')
+
+
+def populate_documents(apps, schema_editor):
+    Book = apps.get_model('home', 'Book')
+    Author = apps.get_model('home', 'Author')
+    BookSearchDocument = apps.get_model('home', 'BookSearchDocument')
+    authors = {}
+    for author in Author.objects.all():
+        authors.setdefault(author.isbn_id, []).append(author)
+    BookSearchDocument.objects.bulk_create(
+        [BookSearchDocument(isbn=book, text=build_document(book, authors.get(book.isbn, [])))
+         for book in Book.objects.all()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0012_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchDocument',
+            fields=[
+                ('isbn', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='home.book')),
+                ('text', models.TextField()),
+            ],
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+    ]
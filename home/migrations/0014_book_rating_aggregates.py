@@ -0,0 +1,45 @@
+# Generated by Django 3.2 on 2026-10-18 11:56
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_ratings(apps, schema_editor):
+    Book = apps.get_model('home', 'Book')
+    Comment = apps.get_model('home', 'Comment')
+    comments = Comment.objects.filter(isbn=models.OuterRef('isbn')).order_by().values('isbn')
+    Book.objects.update(
+        rating_sum=Coalesce(models.Subquery(comments.annotate(total=models.Sum('score')).values('total')), 0),
+        rating_count=Coalesce(models.Subquery(comments.annotate(total=models.Count('id')).values('total')), 0),
+        average_score=Coalesce(models.Subquery(comments.annotate(average=models.Avg('score')).values('average'),
+                                               output_field=models.FloatField()), 0.0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0013_booksearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='average_score',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['average_score', 'isbn'], name='book average score'),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
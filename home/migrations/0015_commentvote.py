@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-18 11:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Cast
+
+
+# scores were computed with a different formula by each rating button, recompute them with the consistent one
+def recompute_usefulness_scores(apps, schema_editor):
+    Comment = apps.get_model('home', 'Comment')
+    very_useful, useful, useless = models.F('very_useful_count'), models.F('useful_count'), models.F('useless_count')
+    Comment.objects.exclude(very_useful_count=0, useful_count=0, useless_count=0).update(
+        usefulness_score=Cast(very_useful * 2 + useful, models.FloatField()) / (very_useful + useful + useless))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0014_book_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentVote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.CharField(choices=[('very_useful', 'very useful'), ('useful', 'useful'), ('useless', 'useless')], max_length=11)),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.comment')),
+                ('username', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.customer')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='commentvote',
+            constraint=models.UniqueConstraint(fields=('comment', 'username'), name='unique comment vote'),
+        ),
+        migrations.RunPython(recompute_usefulness_scores, migrations.RunPython.noop),
+    ]
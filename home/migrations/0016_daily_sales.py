@@ -0,0 +1,77 @@
+# Generated by Django 3.2 on 2026-10-18 12:11
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_sales(apps, schema_editor):
+    BookInOrder = apps.get_model('home', 'BookInOrder')
+    day = TruncDate('order_number__order_time')
+    rollups = [
+        ('DailyBookSales', BookInOrder.objects.values('isbn_id', day=day)),
+        ('DailyAuthorSales', BookInOrder.objects.filter(isbn__author__isnull=False)
+         .values(day=day, first_name=models.F('isbn__author__first_name'),
+                 last_name=models.F('isbn__author__last_name'))),
+        ('DailyPublisherSales', BookInOrder.objects.values(day=day, publisher=models.F('isbn__publisher'))),
+    ]
+    for name, rows in rollups:
+        model = apps.get_model('home', name)
+        model.objects.bulk_create([model(**row) for row in rows.annotate(quantity=models.Sum('count')).order_by()],
+                                  batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0015_commentvote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAuthorSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('first_name', models.CharField(max_length=30)),
+                ('last_name', models.CharField(max_length=30)),
+                ('quantity', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyBookSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyPublisherSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('publisher', models.CharField(max_length=100)),
+                ('quantity', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailypublishersales',
+            constraint=models.UniqueConstraint(fields=('day', 'publisher'), name='unique daily publisher sales'),
+        ),
+        migrations.AddField(
+            model_name='dailybooksales',
+            name='isbn',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.book'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyauthorsales',
+            constraint=models.UniqueConstraint(fields=('day', 'first_name', 'last_name'), name='unique daily author sales'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailybooksales',
+            constraint=models.UniqueConstraint(fields=('day', 'isbn'), name='unique daily book sales'),
+        ),
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.2 on 2026-10-18 12:13
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_aggregates(apps, schema_editor):
+    Customer = apps.get_model('home', 'Customer')
+    TrustedCustomer = apps.get_model('home', 'TrustedCustomer')
+    UntrustedCustomer = apps.get_model('home', 'UntrustedCustomer')
+    Comment = apps.get_model('home', 'Comment')
+
+    def total(queryset, field, aggregate, default=0):
+        return Coalesce(models.Subquery(queryset.order_by().values(field).annotate(total=aggregate).values('total')),
+                        default)
+
+    trusts = total(TrustedCustomer.objects.filter(trusted_username=models.OuterRef('pk')), 'trusted_username',
+                   models.Count('id'))
+    untrusts = total(UntrustedCustomer.objects.filter(untrusted_username=models.OuterRef('pk')), 'untrusted_username',
+                     models.Count('id'))
+    comments = Comment.objects.filter(username=models.OuterRef('pk'))
+    Customer.objects.update(
+        trust_count=trusts, untrust_count=untrusts, net_trust=trusts - untrusts,
+        usefulness_sum=total(comments, 'username', models.Sum('usefulness_score'), 0.0),
+        comment_count=total(comments, 'username', models.Count('id')),
+        average_usefulness=total(comments, 'username', models.Avg('usefulness_score'), 0.0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0016_daily_sales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='average_usefulness',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='net_trust',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='trust_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='untrust_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='usefulness_sum',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['-net_trust', 'user_ptr'], name='customer net trust'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['-average_usefulness', 'user_ptr'], name='customer usefulness'),
+        ),
+        migrations.RunPython(populate_aggregates, migrations.RunPython.noop),
+    ]
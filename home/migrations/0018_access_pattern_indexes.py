@@ -0,0 +1,57 @@
+# Generated by Django 3.2 on 2026-10-18 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0017_customer_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['last_name', 'first_name', 'isbn'], name='author name'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['publication_date', 'isbn'], name='book publication date'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'publication_date', 'isbn'], name='book title'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['publisher', 'publication_date', 'isbn'], name='book publisher'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['subject', 'publication_date', 'isbn'], name='book subject'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['keywords', 'publication_date', 'isbn'], name='book keywords'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['language', 'publication_date', 'isbn'], name='book language'),
+        ),
+        migrations.AddIndex(
+            model_name='bookorder',
+            index=models.Index(fields=['order_time'], name='order time'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyauthorsales',
+            index=models.Index(fields=['day', 'first_name', 'last_name', 'quantity'], name='daily author sales'),
+        ),
+        migrations.AddIndex(
+            model_name='dailybooksales',
+            index=models.Index(fields=['day', 'isbn', 'quantity'], name='daily book sales'),
+        ),
+        migrations.AddIndex(
+            model_name='dailypublishersales',
+            index=models.Index(fields=['day', 'publisher', 'quantity'], name='daily publisher sales'),
+        ),
+    ]
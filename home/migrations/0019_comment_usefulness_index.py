@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0018_access_pattern_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['isbn', '-usefulness_score', '-id'], name='comment usefulness'),
+        ),
+    ]
@@ -17,6 +17,20 @@ class Book(models.Model):
     page_count = models.IntegerField(validators=[v.MinValueValidator(0)])
     stock_level = models.IntegerField(validators=[v.MinValueValidator(0)])
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[v.MinValueValidator(0)])
+    # comment score aggregates, maintained when a comment is written, 0 when the book has no comments
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    average_score = models.FloatField(default=0.0, editable=False)
+
+    class Meta:
+        # the search filters on one field at a time and pages in (sort field, isbn) order
+        indexes = [models.Index(fields=['average_score', 'isbn'], name='book average score'),
+                   models.Index(fields=['publication_date', 'isbn'], name='book publication date'),
+                   models.Index(fields=['title', 'publication_date', 'isbn'], name='book title'),
+                   models.Index(fields=['publisher', 'publication_date', 'isbn'], name='book publisher'),
+                   models.Index(fields=['subject', 'publication_date', 'isbn'], name='book subject'),
+                   models.Index(fields=['keywords', 'publication_date', 'isbn'], name='book keywords'),
+                   models.Index(fields=['language', 'publication_date', 'isbn'], name='book language')]
 
     def __str__(self):
         return f'Title:{self.title} ISBN:{self.isbn}'
@@ -29,6 +43,8 @@ class Author(models.Model):
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=['isbn', 'first_name', 'last_name'], name='unique record')]
+        # looking authors up by name, and listing them by last name
+        indexes = [models.Index(fields=['last_name', 'first_name', 'isbn'], name='author name')]
 
     def __str__(self):
         return f'ISBN:{self.isbn} Name:{self.first_name} {self.last_name}'
@@ -38,6 +54,20 @@ class Customer(User):
     address = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=10)
     banned = models.BooleanField(default=False)
+    # trust and usefulness aggregates, maintained when someone trusts the customer or rates the customer's comments
+    trust_count = models.IntegerField(default=0, editable=False)
+    untrust_count = models.IntegerField(default=0, editable=False)
+    net_trust = models.IntegerField(default=0, editable=False)
+    usefulness_sum = models.FloatField(default=0.0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    average_usefulness = models.FloatField(default=0.0, editable=False)
+
+    class Meta:
+        # the names Customer had from User before it declared its own Meta
+        verbose_name = 'user'
+        verbose_name_plural = 'users'
+        indexes = [models.Index(fields=['-net_trust', 'user_ptr'], name='customer net trust'),
+                   models.Index(fields=['-average_usefulness', 'user_ptr'], name='customer usefulness')]
 
     def __str__(self):
         return f'{self.username}'
@@ -49,6 +79,9 @@ class BookOrder(models.Model):
     order_time = models.DateTimeField(auto_now_add=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [models.Index(fields=['order_time'], name='order time')]
+
     def __str__(self):
         return f'order number:{self.order_time} order_time:{self.order_time}'
 
@@ -62,6 +95,94 @@ class BookInOrder(models.Model):
         return f'order number:{self.order_number} ISBN:{self.isbn} count:{self.count}'
 
 
+# the searchable text of a book and its authors, maintained by signals and indexed FULLTEXT on MySQL
+class BookSearchDocument(models.Model):
+    isbn = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True)
+    text = models.TextField()
+
+    def __str__(self):
+        return f'ISBN:{self.isbn_id}'
+
+
+# total copies sold per book, maintained at checkout so the best sellers are an index read
+class BestSeller(models.Model):
+    isbn = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True)
+    total_quantity = models.IntegerField(default=0, validators=[v.MinValueValidator(0)])
+
+    class Meta:
+        indexes = [models.Index(fields=['-total_quantity', 'isbn'], name='best seller rank')]
+
+    def __str__(self):
+        return f'ISBN:{self.isbn_id} total quantity:{self.total_quantity}'
+
+
+# copies sold per day, per book, per author and per publisher, maintained at checkout so that a sales report over
+# any window sums daily rows instead of scanning the orders
+class DailyBookSales(models.Model):
+    day = models.DateField()
+    isbn = models.ForeignKey(Book, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0, validators=[v.MinValueValidator(0)])
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'isbn'], name='unique daily book sales')]
+        # covers the report, which sums quantities over a range of days, likewise for authors and publishers
+        indexes = [models.Index(fields=['day', 'isbn', 'quantity'], name='daily book sales')]
+
+    def __str__(self):
+        return f'day:{self.day} ISBN:{self.isbn_id} quantity:{self.quantity}'
+
+
+class DailyAuthorSales(models.Model):
+    day = models.DateField()
+    first_name = models.CharField(max_length=30)
+    last_name = models.CharField(max_length=30)
+    quantity = models.IntegerField(default=0, validators=[v.MinValueValidator(0)])
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'first_name', 'last_name'],
+                                               name='unique daily author sales')]
+        indexes = [models.Index(fields=['day', 'first_name', 'last_name', 'quantity'], name='daily author sales')]
+
+    def __str__(self):
+        return f'day:{self.day} name:{self.first_name} {self.last_name} quantity:{self.quantity}'
+
+
+class DailyPublisherSales(models.Model):
+    day = models.DateField()
+    publisher = models.CharField(max_length=100)
+    quantity = models.IntegerField(default=0, validators=[v.MinValueValidator(0)])
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'publisher'], name='unique daily publisher sales')]
+        indexes = [models.Index(fields=['day', 'publisher', 'quantity'], name='daily publisher sales')]
+
+    def __str__(self):
+        return f'day:{self.day} publisher:{self.publisher} quantity:{self.quantity}'
+
+
+# the books most often bought by the customers who bought a book, rebuilt by the build_recommendations command
+class BookNeighbor(models.Model):
+    isbn = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommended_by')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['isbn', 'neighbor'], name='unique book neighbor')]
+        indexes = [models.Index(fields=['isbn', '-score'], name='book neighbor rank')]
+
+    def __str__(self):
+        return f'ISBN:{self.isbn_id} neighbor:{self.neighbor_id} score:{self.score}'
+
+
+# the last order folded into BookNeighbor by each build
+class RecommendationBuild(models.Model):
+    last_order_number = models.IntegerField()
+    built_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'last order number:{self.last_order_number} built at:{self.built_at}'
+
+
 class ShoppingCart(models.Model):
     username = models.ForeignKey(Customer, on_delete=models.RESTRICT)
     isbn = models.ForeignKey(Book, on_delete=models.RESTRICT)
@@ -89,11 +210,28 @@ class Comment(models.Model):
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=['username', 'isbn'], name='unique comment')]
+        # book pages list the most useful comments first and page by (usefulness_score, id)
+        indexes = [models.Index(fields=['isbn', '-usefulness_score', '-id'], name='comment usefulness')]
 
     def __str__(self):
         return f'login name:{self.username}\nisbn:{self.isbn}'
 
 
+# one row per customer and rated comment, so that each customer rates a comment at most once
+class CommentVote(models.Model):
+    RATING_CHOICES = [('very_useful', 'very useful'), ('useful', 'useful'), ('useless', 'useless')]
+
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
+    username = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    rating = models.CharField(max_length=11, choices=RATING_CHOICES)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['comment', 'username'], name='unique comment vote')]
+
+    def __str__(self):
+        return f'comment:{self.comment_id} username:{self.username_id} rating:{self.rating}'
+
+
 class Manager(User):
     def __str__(self):
         return f'{self.username}'
@@ -0,0 +1,69 @@
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import condition
+
+from .caching import get_version, CATALOG_TIER
+
+# Anonymous visitors all see the same page, so their responses are cached whole. A page is keyed by its path and the
+# versions of the content it shows, bumping any of them makes the next request render it again. The ETag is the same
+# key, thus a client revalidating a page it already has gets a 304 without the view running.
+
+
+# the cache key of the page for this request, None when the page has to be rendered for this visitor
+def page_key(request, versions, *args, **kwargs):
+    if not hasattr(request, '_page_key'):
+        if request.method in ('GET', 'HEAD') and not request.user.is_authenticated and not get_messages(request):
+            state = (request.get_full_path(), [get_version(name) for name in versions(request, *args, **kwargs)])
+            request._page_key = f'page:{hashlib.md5(repr(state).encode()).hexdigest()}'
+        else:
+            request._page_key = None
+    return request._page_key
+
+
+# the cached page for a page key, looked up once per request
+def cached_page(request, key):
+    if not hasattr(request, '_cached_page'):
+        request._cached_page = caches[CATALOG_TIER].get(key)
+    return request._cached_page
+
+
+# cache a view's responses to anonymous GETs, versions(request, *args, **kwargs) names the versions of what it shows
+def cache_anonymous_page(versions):
+    def etag(request, *args, **kwargs):
+        key = page_key(request, versions, *args, **kwargs)
+        return key and key.split(':')[1]
+
+    def last_modified(request, *args, **kwargs):
+        key = page_key(request, versions, *args, **kwargs)
+        page = key and cached_page(request, key)
+        return page and page['modified']
+
+    def decorator(view):
+        @condition(etag_func=etag, last_modified_func=last_modified)
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = page_key(request, versions, *args, **kwargs)
+            if key is None:
+                return view(request, *args, **kwargs)
+            page = cached_page(request, key)
+            if page is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+                page = {'content': response.content, 'content_type': response['Content-Type'],
+                        'modified': timezone.now()}
+                caches[CATALOG_TIER].set(key, page)
+            response = HttpResponse(page['content'], content_type=page['content_type'])
+            response['Last-Modified'] = http_date(page['modified'].timestamp())
+            # clients keep the page but check with the ETag before showing it again
+            patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,102 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+
+from .models import Book, BookInOrder, BookNeighbor, BookOrder, BestSeller, RecommendationBuild
+
+NEIGHBOR_COUNT = 20
+
+
+# Item-to-item recommendations: two books are similar when the same customers bought both. The customer x book
+# purchase matrix is sparse, so co-purchase counts are accumulated row by row with Counter.update (a C loop over
+# each customer's books) and scored with cosine similarity. Only the top neighbors of each book are stored.
+
+
+# `purchases` maps a customer to the set of isbns the customer bought, `buyers` maps an isbn to its number of
+# distinct buyers (computed from `purchases` when omitted), only the books in `targets` get neighbors (all if None)
+def compute_neighbors(purchases, buyers=None, targets=None, k=NEIGHBOR_COUNT):
+    if buyers is None:
+        buyers = Counter()
+        for books in purchases.values():
+            buyers.update(books)
+    co_purchases = defaultdict(Counter)
+    for books in purchases.values():
+        for isbn in books:
+            if targets is None or isbn in targets:
+                co_purchases[isbn].update(books)
+    neighbors = {}
+    for isbn, row in co_purchases.items():
+        del row[isbn]
+        scores = ((other, count / math.sqrt(buyers[isbn] * buyers[other])) for other, count in row.items())
+        neighbors[isbn] = heapq.nlargest(k, scores, key=itemgetter(1))
+    return neighbors
+
+
+# map each customer to the set of books the customer bought, optionally only for some customers
+def load_purchases(customers=None):
+    lines = BookInOrder.objects.values_list('order_number__username', 'isbn').distinct()
+    if customers is not None:
+        lines = lines.filter(order_number__username__in=customers)
+    purchases = defaultdict(set)
+    for customer, isbn in lines.iterator():
+        purchases[customer].add(isbn)
+    return purchases
+
+
+# fold the orders placed since the last build into BookNeighbor, or recompute everything when `full`
+# returns the number of books whose neighbors were rewritten
+def build_neighbors(full=False, k=NEIGHBOR_COUNT):
+    last_build = RecommendationBuild.objects.order_by('-id').first()
+    last_order_number = BookOrder.objects.aggregate(last=Max('order_number'))['last'] or 0
+    if full or last_build is None:
+        neighbors = compute_neighbors(load_purchases(), k=k)
+        rescored = None
+    else:
+        if last_order_number <= last_build.last_order_number:
+            return 0
+        # every book of a customer with new orders may have gained buyers or co-purchases, which changes its score
+        # against every book sharing a buyer with it, so all of those books are rescored from their buyers' purchases
+        new_customers = BookOrder.objects.filter(order_number__gt=last_build.last_order_number,
+                                                 order_number__lte=last_order_number).values('username')
+        touched = BookInOrder.objects.filter(order_number__username__in=new_customers).values('isbn')
+        buyers_of_touched = BookInOrder.objects.filter(isbn__in=touched).values('order_number__username')
+        rescored = set(BookInOrder.objects.filter(order_number__username__in=buyers_of_touched)
+                       .values_list('isbn', flat=True).distinct())
+        purchases = load_purchases(BookInOrder.objects.filter(isbn__in=rescored).values('order_number__username'))
+        candidates = set().union(*purchases.values())
+        buyers = dict(BookInOrder.objects.filter(isbn__in=candidates).values('isbn')
+                      .annotate(buyers=Count('order_number__username', distinct=True))
+                      .order_by().values_list('isbn', 'buyers'))
+        neighbors = compute_neighbors(purchases, buyers, rescored, k=k)
+    with transaction.atomic():
+        if rescored is None:
+            BookNeighbor.objects.all().delete()
+        else:
+            BookNeighbor.objects.filter(isbn__in=rescored).delete()
+        BookNeighbor.objects.bulk_create(
+            [BookNeighbor(isbn_id=isbn, neighbor_id=other, score=score)
+             for isbn, scored in neighbors.items() for other, score in scored], batch_size=1000)
+        RecommendationBuild.objects.create(last_order_number=last_order_number)
+    return len(neighbors)
+
+
+# books similar to what the customer bought and that the customer has not bought,
+# topped up with best sellers and then any other books for customers with little history
+def recommend_books(customer, limit=10):
+    purchased = BookInOrder.objects.filter(order_number__username=customer).values('isbn')
+    recommended = list(Book.objects.filter(recommended_by__isbn__in=purchased).exclude(isbn__in=purchased)
+                       .values('isbn', 'title', 'price').annotate(score=Sum('recommended_by__score'))
+                       .order_by('-score', 'isbn')[:limit])
+    fallbacks = [BestSeller.objects.values('isbn', title=F('isbn__title'), price=F('isbn__price'))
+                     .order_by('-total_quantity', 'isbn'),
+                 Book.objects.values('isbn', 'title', 'price')]
+    for fallback in fallbacks:
+        if len(recommended) >= limit:
+            break
+        chosen = [book['isbn'] for book in recommended]
+        recommended += fallback.exclude(isbn__in=purchased).exclude(isbn__in=chosen)[:limit - len(recommended)]
+    return recommended
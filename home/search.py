@@ -0,0 +1,163 @@
+import bisect
+import heapq
+import re
+from array import array
+from collections import Counter, defaultdict
+from itertools import islice
+from operator import itemgetter
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .caching import get_version, bump_version
+from .models import Book, Author, BookSearchDocument
+
+SEARCH_VERSION = 'search'
+TOKEN_PATTERN = re.compile(r'\w+')
+# how many times each field is repeated in a search document, so that both MySQL's relevance and the term
+# frequencies of the fallback index rank a title match above a publisher match
+FIELD_WEIGHTS = {'title': 3, 'authors': 2, 'keywords': 2, 'subject': 1, 'publisher': 1}
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def build_document(book, authors):
+    fields = {'title': book.title,
+              'authors': ' '.join(f'{author.first_name} {author.last_name}' for author in authors),
+              'keywords': book.keywords,
+              'subject': book.subject,
+              'publisher': book.publisher}
+    return ' '.join(' '.join([fields[field]] * weight) for field, weight in FIELD_WEIGHTS.items())
+
+
+# Pure-Python inverted index, used on databases without MySQL FULLTEXT. Books are numbered internally and each
+# term maps to compact arrays of book numbers and term frequencies. Re-indexing a book gives it a new number and
+# the postings of the old number are skipped as stale.
+class InvertedIndex:
+    def __init__(self):
+        self.isbns = []
+        self.numbers = {}
+        self.postings = defaultdict(lambda: (array('I'), array('H')))
+        self.terms = []
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def add(self, isbn, document):
+        number = len(self.isbns)
+        self.isbns.append(isbn)
+        self.numbers[isbn] = number
+        for term, count in Counter(tokenize(document)).items():
+            if term not in self.postings:
+                bisect.insort(self.terms, term)
+            numbers, counts = self.postings[term]
+            numbers.append(number)
+            counts.append(min(count, 0xFFFF))
+
+    def remove(self, isbn):
+        self.numbers.pop(isbn, None)
+
+    # every indexed term starting with prefix
+    def expand(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + '\uffff', start)
+        return self.terms[start:end]
+
+    # isbns of the books matching every token of the query as a word prefix, best first
+    def search(self, query, limit):
+        scores = None
+        for token in tokenize(query):
+            token_scores = defaultdict(int)
+            for term in self.expand(token):
+                for number, count in zip(*self.postings[term]):
+                    token_scores[number] += count
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {number: score + token_scores[number] for number, score in scores.items()
+                          if number in token_scores}
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        live = ((number, score) for number, score in scores.items() if self.numbers.get(self.isbns[number]) == number)
+        return [self.isbns[number] for number, _ in heapq.nlargest(limit, live, key=itemgetter(1))]
+
+
+def uses_fulltext():
+    return connection.vendor == 'mysql'
+
+
+_local_index = None
+_local_version = None
+
+
+# the fallback index of this process, rebuilt when another process changed the search documents
+def get_local_index():
+    global _local_index, _local_version
+    version = get_version(SEARCH_VERSION)
+    if _local_index is None or _local_version != version:
+        index = InvertedIndex()
+        for isbn, text in BookSearchDocument.objects.values_list('isbn', 'text').iterator():
+            index.add(isbn, text)
+        _local_index, _local_version = index, version
+    return _local_index
+
+
+# isbns of the books matching a free text query, most relevant first
+def search_books(query, limit=1000):
+    if not tokenize(query):
+        return []
+    if uses_fulltext():
+        # every word is required and may be the start of a longer word
+        boolean_query = ' '.join(f'+{token}*' for token in tokenize(query))
+        match = RawSQL('MATCH (text) AGAINST (%s IN BOOLEAN MODE)', [boolean_query])
+        return list(BookSearchDocument.objects.annotate(rank=match).filter(rank__gt=0)
+                    .order_by('-rank').values_list('isbn', flat=True)[:limit])
+    return get_local_index().search(query, limit)
+
+
+# refresh the search document of one book after it or one of its authors changed
+def index_book(isbn):
+    try:
+        book = Book.objects.get(isbn=isbn)
+    except Book.DoesNotExist:
+        return
+    document = build_document(book, Author.objects.filter(isbn=isbn))
+    BookSearchDocument.objects.update_or_create(isbn=book, defaults={'text': document})
+    transaction.on_commit(lambda: document_changed(isbn, document))
+
+
+def unindex_book(isbn):
+    BookSearchDocument.objects.filter(isbn=isbn).delete()
+    transaction.on_commit(lambda: document_changed(isbn, None))
+
+
+# once a document is committed (or its deletion, with document None), it is added to or dropped from the index of
+# this process and other processes rebuild theirs; a rolled back change never reaches an index
+def document_changed(isbn, document):
+    global _local_version
+    up_to_date = _local_index is not None and _local_version == get_version(SEARCH_VERSION)
+    bump_version(SEARCH_VERSION)
+    if up_to_date:
+        if document is None:
+            _local_index.remove(isbn)
+        else:
+            _local_index.add(isbn, document)
+        _local_version = get_version(SEARCH_VERSION)
+
+
+# recompute every search document
+def rebuild_index(batch_size=1000):
+    authors = defaultdict(list)
+    for author in Author.objects.only('isbn', 'first_name', 'last_name').iterator():
+        authors[author.isbn_id].append(author)
+    documents = (BookSearchDocument(isbn=book, text=build_document(book, authors[book.isbn]))
+                 for book in Book.objects.iterator(chunk_size=batch_size))
+    with transaction.atomic():
+        BookSearchDocument.objects.all().delete()
+        while batch := list(islice(documents, batch_size)):
+            BookSearchDocument.objects.bulk_create(batch)
+    bump_version(SEARCH_VERSION)
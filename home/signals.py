@@ -0,0 +1,94 @@
+from django.db import transaction
+from django.db.models import FloatField, Subquery
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .caching import bump_version, trust_version, book_version, CATALOG_VERSION, COMMENT_VERSION
+from .models import Book, Author, Comment, Customer, TrustedCustomer, UntrustedCustomer
+from .middleware import forget_customer
+from .graph import author_added, authors_changed
+from .search import index_book, unindex_book
+from .utils import add_customer_comments
+
+
+# any change to books or authors may change the search facets and every cached catalog page, which is bumped once
+# the change is committed so that no request can cache the old content under the new version
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Author)
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(CATALOG_VERSION))
+
+
+# the book's cached pages and fragments are stale, likewise once the change is committed
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Comment)
+def book_content_changed(sender, instance, **kwargs):
+    isbn = instance.pk if sender is Book else instance.isbn_id
+    transaction.on_commit(lambda: bump_version(book_version(isbn)))
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_book(instance.isbn)
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    unindex_book(instance.isbn)
+
+
+@receiver([post_save, post_delete], sender=Author)
+def author_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_book(instance.isbn_id)
+
+
+# the co-author graph of this process and the version of every other process's graph follow committed authors only
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: author_added(instance))
+    else:
+        transaction.on_commit(authors_changed)
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    transaction.on_commit(authors_changed)
+
+
+# the author's comment count and usefulness aggregates follow every comment, however it is written or deleted;
+# fixtures load the customers with their aggregates
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add_customer_comments(instance.username_id, 1, instance.usefulness_score)
+
+
+# before the row is gone, ratings update its score without touching the instance
+@receiver(pre_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    score = Subquery(Comment.objects.filter(pk=instance.pk).values('usefulness_score'), output_field=FloatField())
+    add_customer_comments(instance.username_id, -1, -score)
+
+
+# once committed, like the catalog
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(COMMENT_VERSION))
+
+
+# the customer's cached trust sets and trusted score results are stale
+@receiver([post_save, post_delete], sender=TrustedCustomer)
+@receiver([post_save, post_delete], sender=UntrustedCustomer)
+def trust_changed(sender, instance, **kwargs):
+    version = trust_version(instance.username_id)
+    transaction.on_commit(lambda: bump_version(version))
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def customer_changed(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: forget_customer(pk))
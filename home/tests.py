@@ -1,3 +1,1114 @@
-from django.test import TestCase
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, connections, transaction, IntegrityError, OperationalError
+from django.db.utils import load_backend
+from django.db.models import F, Sum
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache_backends import cache_stats, LocMemCache, FileBasedCache
+from .caching import clear_caches, CATALOG_TIER
+from .db_backends import ConnectionPool, PoolTimeout, get_pool, close_pools
+from .forms import BookSearchForm, DegreeOfSeparationSearchForm
+from .models import *
+from .graph import CoAuthorGraph, get_coauthor_graph
+from .instrumentation import view_stats, percentile, QueryBudgetExceeded
+from .search import InvertedIndex, search_books
+from .recommendations import build_neighbors, compute_neighbors, recommend_books
+from .utils import place_order, InsufficientStock, get_order_history, change_customer_trust_status, add_comment, \
+    rate_comment, CannotRateComment, add_to_cart, change_cart_quantity, \
+    get_cart_summary, trusted_score_books, SEARCH_PAGE_SIZE, \
+    COMMENT_COUNT_CHOICES
+
+
+def create_book(isbn, stock_level=10, price=10):
+    return Book.objects.create(isbn=isbn, title=f'Book {isbn}', publisher='Publisher',
+                               publication_date=date(2020, 1, 1), subject='Subject', keywords='Keyword',
+                               language='English', page_count=100, stock_level=stock_level, price=price)
+
+
+def create_customer(username):
+    return Customer.objects.create_user(username=username, password='password', address='Address',
+                                        phone_number='0123456789')
+
+
+class BookDetailTest(TestCase):
+    def setUp(self):
+        self.book = create_book('1234567890123')
+        self.viewer = create_customer('viewer')
+        self.client.force_login(self.viewer)
+        # compare warm requests, the customer row and the cart badge are cached
+        self.client.get(reverse('home'))
+
+    def add_comments(self, start, end):
+        # the cached fragments of the book are invalidated when the comments are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_comments(start, end)
+
+    def create_comments(self, start, end):
+        for i in range(start, end):
+            author = create_customer(f'author{i}')
+            Comment.objects.create(username=author, isbn=self.book, score=5, comment_text='text')
+            if i % 2 == 0:
+                TrustedCustomer.objects.create(username=self.viewer, trusted_username=author)
+            else:
+                UntrustedCustomer.objects.create(username=self.viewer, untrusted_username=author)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book_detail', args=[self.book.isbn]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_independent_of_comment_count(self):
+        self.add_comments(0, 2)
+        few = self.count_queries()
+        self.add_comments(2, 12)
+        self.assertEqual(self.count_queries(), few)
+
+    def test_trust_status(self):
+        self.add_comments(0, 2)
+        Comment.objects.create(username=self.viewer, isbn=self.book, score=5, comment_text='text')
+        response = self.client.get(reverse('book_detail', args=[self.book.isbn]))
+        statuses = sorted(response.context['trust_status'].values())
+        self.assertEqual(statuses, ['self', 'trust', 'untrust'])
+
+    def test_most_useful_comments_paged(self):
+        self.add_comments(0, 12)
+        for i, comment in enumerate(Comment.objects.order_by('id')):
+            # ties on the score are broken by the newest comment first
+            comment.usefulness_score = i % 4
+            comment.save()
+        expected = list(Comment.objects.order_by('-usefulness_score', '-id').values_list('id', flat=True))
+        url = reverse('book_detail', args=[self.book.isbn])
+        seen, params = [], {'n': 5}
+        while True:
+            response = self.client.get(url, params)
+            self.assertLessEqual(len(response.context['comments']), 5)
+            seen += [comment.id for comment in response.context['comments']]
+            if response.context['next_comments'] is None:
+                break
+            params['after'] = response.context['next_comments']
+        self.assertEqual(seen, expected)
+        # an unknown count falls back to the default
+        response = self.client.get(url, {'n': 7})
+        self.assertEqual(response.context['comment_count'], COMMENT_COUNT_CHOICES[0])
+        self.assertEqual(len(response.context['comments']), COMMENT_COUNT_CHOICES[0])
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.book = create_book('1234567890123')
+        self.url = reverse('book_detail', args=[self.book.isbn])
+
+    def test_anonymous_pages_cached_until_content_changes(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        home = self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).content, response.content)
+            self.assertEqual(self.client.get(reverse('home')).content, home.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(isbn=self.book.isbn).get().save()
+            add_comment(create_customer('author'), self.book.isbn, 7, 'a new comment')
+        response = self.client.get(self.url)
+        self.assertContains(response, 'a new comment')
+        self.assertNotEqual(response['ETag'], etag)
+        # ratings are written with an UPDATE and bump the book's version explicitly
+        rate_comment(create_customer('voter'), self.book.isbn, Comment.objects.get().id, 'useful')
+        self.assertNotEqual(self.client.get(self.url)['ETag'], response['ETag'])
+
+    def test_search_results_not_cached(self):
+        other = create_book('1234567890124')
+        params = {'book_search': '', 'language': 'English', 'sort_by': BookSearchForm.SORT_CHOICE['score']}
+
+        def isbns():
+            return [row['isbn'] for row in self.client.get(reverse('book_search'), params).context['book_results']]
+
+        self.assertEqual(isbns(), [self.book.isbn, other.isbn])
+        # the score is written with an UPDATE, which bumps no version
+        add_comment(create_customer('author'), self.book.isbn, 7, 'text')
+        self.assertEqual(isbns(), [other.isbn, self.book.isbn])
+        self.assertTrue(self.client.get(reverse('book_search')).has_header('ETag'))
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                             304)
+        # checkout changes the stock level shown on the page
+        buyer = create_customer('buyer')
+        add_to_cart(buyer, self.book.isbn)
+        place_order(buyer)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_logged_in_pages_not_cached(self):
+        self.client.force_login(create_customer('viewer'))
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertContains(response, 'Write a comment')
+
+
+class CacheTierTest(TestCase):
+    def setUp(self):
+        cache_stats.clear()
+
+    def test_least_recently_used_evicted(self):
+        tier = LocMemCache('lru test', {'KEY_PREFIX': 'lru', 'OPTIONS': {'MAX_ENTRIES': 3}})
+        tier.clear()
+        for key in 'abc':
+            tier.set(key, key)
+        tier.get('a')
+        tier.set('d', 'd')
+        self.assertEqual(tier.get_many('abcd'), {'a': 'a', 'c': 'c', 'd': 'd'})
+        self.assertIsNone(tier.get('b'))
+        self.assertEqual(cache_stats.summary()['lru'], {'hits': 4, 'misses': 2, 'evictions': 1, 'hit_rate': 4 / 6})
+
+    def test_file_evictions_counted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tier = FileBasedCache(directory, {'KEY_PREFIX': 'files', 'OPTIONS': {'MAX_ENTRIES': 2,
+                                                                                  'CULL_FREQUENCY': 2}})
+            for key in 'abc':
+                tier.set(key, key)
+            self.assertEqual(tier.size(), 2)
+        self.assertEqual(cache_stats.summary()['files']['evictions'], 1)
+
+    def test_stats_page(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        response = self.client.get(reverse('admin_cache_stats'))
+        self.assertEqual([row['tier'] for row in response.context['rows']], list(settings.CACHES))
+        catalog = next(row for row in response.context['rows'] if row['tier'] == CATALOG_TIER)
+        self.assertGreater(catalog['counts'][0], 0)
+        self.assertContains(self.client.get(reverse('admin_cache_stats'), {'format': 'prometheus'}),
+                            'bookstore_cache_hits_total{tier="catalog"}')
+
+
+class SearchFormChoicesTest(TestCase):
+    def test_choices_follow_catalog_changes(self):
+        book = create_book('1000000000001')
+        Author.objects.create(isbn=book, first_name='Ada', last_name='Lovelace')
+        self.assertIn(('Ada_Lovelace', 'Ada Lovelace'), DegreeOfSeparationSearchForm().fields['author'].choices)
+        with self.assertNumQueries(0):
+            list(DegreeOfSeparationSearchForm().fields['author'].choices)
+
+        # the choices are recomputed once the changes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            book.subject = 'Mathematics'
+            book.save()
+            Author.objects.create(isbn=book, first_name='Alan', last_name='Turing')
+        form = BookSearchForm()
+        self.assertIn(('Mathematics', 'Mathematics'), form.fields['subject'].choices)
+        self.assertIn(('Alan_Turing', 'Alan Turing'), form.fields['author'].choices)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        # the fallback index of the test process must not outlive the rolled back books of other tests
+        clear_caches()
+
+    def test_inverted_index(self):
+        index = InvertedIndex()
+        index.add('1', 'Gardening Basics')
+        index.add('2', 'Cooking for Gardeners Gardeners')
+        index.add('3', 'Cooking Basics')
+        self.assertEqual(index.search('garden', 10), ['2', '1'])
+        self.assertEqual(index.search('cook bas', 10), ['3'])
+        index.remove('2')
+        index.add('2', 'Sailing')
+        self.assertEqual(index.search('garden', 10), ['1'])
+        self.assertEqual(index.search('', 10), [])
+
+    def test_index_follows_books_and_authors(self):
+        book = create_book('1000000000001')
+        book.title = 'The Art of Computer Programming'
+        book.save()
+        other = create_book('1000000000002')
+        other.publisher = 'Programming Press'
+        other.save()
+        self.assertEqual(search_books('program'), [book.isbn, other.isbn])
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(isbn=other, first_name='Donald', last_name='Knuth')
+        self.assertEqual(search_books('knuth'), [other.isbn])
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(search_books('program'), [other.isbn])
+
+    def test_rolled_back_books_not_in_index(self):
+        self.assertEqual(search_books('zzphantom'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    book = create_book('1000000000001')
+                    book.title = 'zzphantom'
+                    book.save()
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(search_books('zzphantom'), [])
+
+    def test_search_view(self):
+        book = create_book('1000000000001')
+        book.title = 'Structure and Interpretation of Computer Programs'
+        book.save()
+        response = self.client.post(reverse('book_search'), {'query': 'interpret'})
+        self.assertEqual([result['isbn'] for result in response.context['book_results']], [book.isbn])
+
+
+class BookRatingTest(TestCase):
+    def test_ratings_maintained_and_reconciled(self):
+        book, other = create_book('1000000000001'), create_book('1000000000002')
+        for i, score in enumerate((3, 4, 8)):
+            add_comment(create_customer(f'customer{i}'), book.isbn, str(score), 'text')
+        book.refresh_from_db()
+        self.assertEqual((book.rating_sum, book.rating_count, book.average_score), (15, 3, 5.0))
+
+        Book.objects.update(rating_sum=0, rating_count=0, average_score=0)
+        call_command('reconcile_aggregates', stdout=StringIO())
+        book.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((book.rating_sum, book.rating_count, book.average_score), (15, 3, 5.0))
+        self.assertEqual((other.rating_sum, other.rating_count, other.average_score), (0, 0, 0.0))
+
+    def test_comment_from_book_detail(self):
+        book = create_book('1000000000001')
+        self.client.force_login(create_customer('customer'))
+        response = self.client.post(reverse('book_detail', args=[book.isbn]), {'comment_textarea': 'Good',
+                                                                               'scores': '7'})
+        self.assertContains(response, '7.0 from 1 comment')
+        response = self.client.get(reverse('book_search'), {'book_search': '', 'language': 'English',
+                                                            'sort_by': BookSearchForm.SORT_CHOICE['score']})
+        self.assertEqual(response.context['book_results'][0]['avg_score'], 7.0)
+
+
+class CommentRatingTest(TestCase):
+    def setUp(self):
+        self.book = create_book('1000000000001')
+        self.author = create_customer('author')
+        self.comment = add_comment(self.author, self.book.isbn, 5, 'text')
+
+    def test_score_and_ledger(self):
+        voters = [create_customer(f'voter{i}') for i in range(3)]
+        for voter, rating in zip(voters, ('very_useful', 'useful', 'useless')):
+            rate_comment(voter, self.comment.isbn_id, self.comment.id, rating)
+        self.comment.refresh_from_db()
+        self.assertEqual((self.comment.very_useful_count, self.comment.useful_count, self.comment.useless_count),
+                         (1, 1, 1))
+        self.assertEqual(self.comment.usefulness_score, 1.0)
+
+        with self.assertRaises(CannotRateComment):
+            rate_comment(voters[0], self.comment.isbn_id, self.comment.id, 'useless')
+        with self.assertRaises(CannotRateComment):
+            rate_comment(self.author, self.comment.isbn_id, self.comment.id, 'very_useful')
+        with self.assertRaises(Comment.DoesNotExist):
+            rate_comment(voters[0], self.comment.isbn_id, self.comment.id + 1, 'useful')
+        # a comment is only rated from the page of its book
+        with self.assertRaises(Comment.DoesNotExist):
+            rate_comment(voters[0], '0000000000000', self.comment.id, 'useful')
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.useless_count + self.comment.very_useful_count, 2)
+
+    @override_settings(COMMENT_VOTE_LEDGER=False)
+    def test_without_ledger(self):
+        voter = create_customer('voter')
+        for _ in range(3):
+            rate_comment(voter, self.comment.isbn_id, self.comment.id, 'very_useful')
+        self.comment.refresh_from_db()
+        self.assertEqual((self.comment.very_useful_count, self.comment.usefulness_score), (3, 2.0))
+
+
+class CustomerAggregatesTest(TestCase):
+    def setUp(self):
+        self.customers = [create_customer(f'customer{i}') for i in range(4)]
+
+    def aggregates(self, customer):
+        return Customer.objects.values_list('trust_count', 'untrust_count', 'net_trust').get(pk=customer.pk)
+
+    def test_trust_counters(self):
+        first, second, third, target = self.customers
+        change_customer_trust_status(first, target, 'trust')
+        change_customer_trust_status(first, target, 'trust')
+        change_customer_trust_status(second, target, 'trust')
+        change_customer_trust_status(third, target, 'untrust')
+        self.assertEqual(self.aggregates(target), (2, 1, 1))
+        change_customer_trust_status(second, target, 'untrust')
+        self.assertEqual(self.aggregates(target), (1, 2, -1))
+        self.assertEqual(self.aggregates(first), (0, 0, 0))
+
+    def test_usefulness_follows_ratings(self):
+        author, *voters = self.customers
+        books = [create_book(f'100000000000{i}') for i in range(3)]
+        comments = [add_comment(author, book.isbn, 5, 'text') for book in books]
+        rate_comment(voters[0], comments[0].isbn_id, comments[0].id, 'very_useful')
+        rate_comment(voters[1], comments[0].isbn_id, comments[0].id, 'useless')
+        rate_comment(voters[0], comments[1].isbn_id, comments[1].id, 'useful')
+        # (1.0 + 1.0 + 0.0) / 3
+        author.refresh_from_db()
+        self.assertEqual(author.comment_count, 3)
+        self.assertAlmostEqual(author.usefulness_sum, 2.0)
+        self.assertAlmostEqual(author.average_usefulness, 2 / 3)
+
+        Customer.objects.update(usefulness_sum=0, comment_count=0, average_usefulness=0, net_trust=5)
+        call_command('reconcile_aggregates', stdout=StringIO())
+        author.refresh_from_db()
+        self.assertEqual((author.comment_count, author.net_trust), (3, 0))
+        self.assertAlmostEqual(author.average_usefulness, 2 / 3)
+
+    def test_comments_written_without_add_comment(self):
+        author, voter, *_ = self.customers
+        book = create_book('1000000000001')
+        comment = Comment.objects.create(username=author, isbn=book, score=5, comment_text='text')
+        rate_comment(voter, comment.isbn_id, comment.id, 'very_useful')
+        author.refresh_from_db()
+        self.assertEqual((author.comment_count, author.usefulness_sum, author.average_usefulness), (1, 2.0, 2.0))
+        comment.delete()
+        author.refresh_from_db()
+        self.assertEqual((author.comment_count, author.usefulness_sum, author.average_usefulness), (0, 0.0, 0.0))
+
+    def test_report(self):
+        first, second, third, fourth = self.customers
+        for customer, targets in ((first, [second, third]), (second, [third]), (fourth, [second])):
+            for target in targets:
+                change_customer_trust_status(customer, target, 'trust')
+        change_customer_trust_status(first, fourth, 'untrust')
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        response = self.client.post(reverse('admin_user_report'), {'number': 4, 'top_trusted': ''})
+        self.assertEqual([(row['username'], row['net_trust']) for row in response.context['customers']],
+                         [('customer1', 2), ('customer2', 2), ('customer0', 0), ('customer3', -1)])
+        self.assertContains(response, '2 trusted, 0 untrusted')
+
+
+class SearchPaginationTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        for i in range(7):
+            book = create_book(f'100000000000{i}')
+            book.title = f'Volume {i}'
+            book.publication_date = date(2000 + i % 3, 1, 1)
+            book.save()
+
+    def collect(self, params):
+        isbns = []
+        params = {'book_search': '', 'language': 'English', **params}
+        while True:
+            response = self.client.get(reverse('book_search'), params)
+            isbns += [book['isbn'] for book in response.context['book_results']]
+            if 'next_page_params' not in response.context:
+                return isbns
+            params = QueryDict(response.context['next_page_params'])
+
+    def test_keyset_pages_cover_every_book_once(self):
+        with patch('home.utils.SEARCH_PAGE_SIZE', 3):
+            expected = list(Book.objects.order_by('publication_date', 'isbn').values_list('isbn', flat=True))
+            self.assertEqual(self.collect({'sort_by': BookSearchForm.SORT_CHOICE['publication_date']}), expected)
+            self.assertEqual(self.collect({'sort_by': BookSearchForm.SORT_CHOICE['score']}), sorted(expected))
+            self.assertEqual(sorted(self.collect({'query': 'volume'})), sorted(expected))
+
+    def test_full_text_query_with_filter(self):
+        book = Book.objects.get(isbn='1000000000006')
+        book.language = 'French'
+        book.save()
+        with patch('home.utils.SEARCH_PAGE_SIZE', 3):
+            # the first page holds the match even if the ranking puts it after a page of other languages
+            response = self.client.get(reverse('book_search'), {'book_search': '', 'query': 'volume',
+                                                                'language': 'French'})
+            self.assertEqual([row['isbn'] for row in response.context['book_results']], [book.isbn])
+            self.assertNotIn('next_page_params', response.context)
+            self.assertEqual(len(self.collect({'query': 'volume'})), 6)
+
+    def test_streaming_export(self):
+        params = {'book_search': '', 'language': 'English', 'format': 'json'}
+        response = self.client.get(reverse('book_search'), params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 7)
+        params['format'] = 'csv'
+        response = self.client.get(reverse('book_search'), params)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 8)
+
+
+class TrustedScoreSortTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.book = create_book('1000000000001')
+        self.viewer = create_customer('viewer')
+        self.friend, self.foe, self.stranger = [create_customer(name) for name in ('friend', 'foe', 'stranger')]
+        for customer, score in ((self.friend, 8), (self.foe, 1), (self.stranger, 3)):
+            Comment.objects.create(username=customer, isbn=self.book, score=score, comment_text='text')
+        change_customer_trust_status(self.viewer, self.friend, 'trust')
+        change_customer_trust_status(self.viewer, self.foe, 'untrust')
+        self.client.force_login(self.viewer)
+
+    def search(self):
+        response = self.client.get(reverse('book_search'), {
+            'book_search': '', 'subject': 'Subject', 'sort_by': BookSearchForm.SORT_CHOICE['trusted_score']})
+        return [(book['isbn'], book['avg_score']) for book in response.context['book_results']]
+
+    def test_average_of_trusted_scores_only(self):
+        self.assertEqual(self.search(), [(self.book.isbn, 8)])
+        # cached until the viewer's trust changes
+        with CaptureQueriesContext(connection) as queries:
+            self.search()
+        self.assertFalse([query for query in queries if 'home_book' in query['sql']])
+        with self.captureOnCommitCallbacks(execute=True):
+            change_customer_trust_status(self.viewer, self.stranger, 'trust')
+        self.assertEqual(self.search(), [(self.book.isbn, 5.5)])
+        with self.captureOnCommitCallbacks(execute=True):
+            change_customer_trust_status(self.viewer, self.friend, 'untrust')
+        self.assertEqual(self.search(), [(self.book.isbn, 3)])
+
+
+class CoAuthorGraphTest(TestCase):
+    def test_degrees_and_paths(self):
+        graph = CoAuthorGraph()
+        for isbn, names in (('1', ['A', 'B']), ('2', ['B', 'C']), ('3', ['C', 'D', 'E']), ('4', ['F'])):
+            for name in names:
+                graph.add_author(isbn, name, 'Smith')
+        self.assertEqual(graph.authors_at_degree(('A', 'Smith'), 1), [('B', 'Smith')])
+        self.assertEqual(graph.authors_at_degree(('A', 'Smith'), 2), [('C', 'Smith')])
+        self.assertEqual(sorted(graph.authors_at_degree(('A', 'Smith'), 3)), [('D', 'Smith'), ('E', 'Smith')])
+        self.assertEqual(graph.authors_at_degree(('A', 'Smith'), 4), [])
+        self.assertEqual([name for name, _ in graph.shortest_path(('A', 'Smith'), ('E', 'Smith'))],
+                         ['A', 'B', 'C', 'E'])
+        self.assertEqual(graph.shortest_path(('A', 'Smith'), ('A', 'Smith')), [('A', 'Smith')])
+        self.assertIsNone(graph.shortest_path(('A', 'Smith'), ('F', 'Smith')))
+
+    def test_view_keeps_authors_sharing_a_name(self):
+        clear_caches()
+        first, second = create_book('1000000000001'), create_book('1000000000002')
+        Author.objects.create(isbn=first, first_name='Ada', last_name='Lovelace')
+        Author.objects.create(isbn=first, first_name='Ada', last_name='Byron')
+        self.client.post(reverse('degree_of_separation_search'),
+                         {'author': 'Ada_Lovelace', 'degree_of_separation': 1})
+        # added after the graph was built
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(isbn=second, first_name='Ada', last_name='Byron')
+            Author.objects.create(isbn=second, first_name='Charles', last_name='Babbage')
+        response = self.client.post(reverse('degree_of_separation_search'),
+                                    {'author': 'Ada_Lovelace', 'degree_of_separation': 2})
+        authors = response.context['authors']
+        self.assertEqual([(author['first_name'], author['last_name']) for author in authors], [('Charles', 'Babbage')])
+        self.assertEqual([book.isbn for book in authors[0]['books']], [second.isbn])
+
+
+    def test_rolled_back_authors_not_in_graph(self):
+        clear_caches()
+        book = create_book('1000000000001')
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(isbn=book, first_name='Ada', last_name='Lovelace')
+        get_coauthor_graph()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Author.objects.create(isbn=book, first_name='Charles', last_name='Babbage')
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertNotIn(('Charles', 'Babbage'), get_coauthor_graph().numbers)
+        self.assertIn(('Ada', 'Lovelace'), get_coauthor_graph().numbers)
+
+
+class ShoppingCartTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.customer = create_customer('buyer')
+        self.book = create_book('1000000000001')
+
+    def count(self):
+        return ShoppingCart.objects.filter(username=self.customer, isbn=self.book).values_list('count', flat=True) \
+            .first()
+
+    def test_single_statement_mutations(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(add_to_cart(self.customer, self.book.isbn))
+        with self.assertNumQueries(1):
+            add_to_cart(self.customer, self.book.isbn)
+        self.assertEqual(self.count(), 2)
+        with self.assertNumQueries(1):
+            change_cart_quantity(self.customer, self.book.isbn, 'increase')
+        with self.assertNumQueries(1):
+            change_cart_quantity(self.customer, self.book.isbn, 'decrease')
+        self.assertEqual(self.count(), 2)
+        change_cart_quantity(self.customer, self.book.isbn, 'decrease')
+        change_cart_quantity(self.customer, self.book.isbn, 'decrease')
+        self.assertIsNone(self.count())
+        # lines that are not in the cart are left alone
+        change_cart_quantity(self.customer, self.book.isbn, 'increase')
+        self.assertIsNone(self.count())
+
+    def test_cached_cart_summary(self):
+        add_to_cart(self.customer, self.book.isbn)
+        add_to_cart(self.customer, self.book.isbn)
+        self.client.force_login(self.customer)
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        self.assertFalse([query for query in queries if 'home_shoppingcart' in query['sql']])
+        self.assertEqual((response.context['cart_count'], response.context['cart_total']), (2, 20))
+        change_cart_quantity(self.customer, self.book.isbn, 'decrease')
+        self.assertEqual(get_cart_summary(self.customer.pk)['count'], 1)
+        place_order(self.customer)
+        self.assertEqual(get_cart_summary(self.customer.pk)['lines'], [])
+
+    def test_unknown_book(self):
+        self.assertFalse(add_to_cart(self.customer, '9999999999999'))
+        self.assertFalse(ShoppingCart.objects.exists())
+
+    def test_add_from_book_detail(self):
+        self.client.force_login(self.customer)
+        for _ in range(2):
+            response = self.client.post(reverse('book_detail', args=[self.book.isbn]), {'add_to_shopping_cart': ''})
+            self.assertRedirects(response, reverse('shopping_cart'))
+        self.assertEqual(self.count(), 2)
+
+
+class CheckoutTest(TestCase):
+    def setUp(self):
+        self.customer = create_customer('buyer')
+
+    def test_order_created_and_stock_decremented(self):
+        first, second = create_book('1000000000001', stock_level=5, price=3), create_book('1000000000002', price=4)
+        ShoppingCart.objects.create(username=self.customer, isbn=first, count=2)
+        ShoppingCart.objects.create(username=self.customer, isbn=second, count=1)
+        order = place_order(self.customer)
+        self.assertEqual(order.total_price, 10)
+        self.assertEqual(BookInOrder.objects.filter(order_number=order).count(), 2)
+        self.assertEqual(Book.objects.get(isbn=first.isbn).stock_level, 3)
+        self.assertFalse(ShoppingCart.objects.filter(username=self.customer).exists())
+
+    def test_insufficient_stock_writes_nothing(self):
+        first, second = create_book('1000000000001', stock_level=5), create_book('1000000000002', stock_level=1)
+        ShoppingCart.objects.create(username=self.customer, isbn=first, count=2)
+        ShoppingCart.objects.create(username=self.customer, isbn=second, count=2)
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(self.customer)
+        self.assertEqual([book.isbn for book in raised.exception.books], [second.isbn])
+        self.assertEqual(Book.objects.get(isbn=first.isbn).stock_level, 5)
+        self.assertFalse(BookOrder.objects.exists())
+        self.assertEqual(ShoppingCart.objects.filter(username=self.customer).count(), 2)
+
+    def test_empty_cart(self):
+        self.assertIsNone(place_order(self.customer))
+
+    def test_best_sellers_follow_orders(self):
+        first, second = create_book('1000000000001'), create_book('1000000000002')
+        for count in (1, 2):
+            ShoppingCart.objects.create(username=self.customer, isbn=first, count=count)
+            ShoppingCart.objects.create(username=self.customer, isbn=second, count=1)
+            place_order(self.customer)
+        response = self.client.get(reverse('home'))
+        best_sellers = [(book['isbn'], book['total_quantity']) for book in response.context['most_purchased_books']]
+        self.assertEqual(best_sellers, [(first.isbn, 3), (second.isbn, 2)])
+
+        BestSeller.objects.all().delete()
+        call_command('rebuild_best_sellers', stdout=StringIO())
+        self.assertEqual(list(BestSeller.objects.order_by('-total_quantity').values_list('isbn', 'total_quantity')),
+                         best_sellers)
+
+
+class CustomerMiddlewareTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.customer = create_customer('buyer')
+        self.other = create_customer('other')
+        self.client.force_login(self.customer)
+
+    def customer_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400)
+        return [query for query in queries if query['sql'].startswith('SELECT "home_customer"."address"')]
+
+    @override_settings(CUSTOMER_CACHE_TIMEOUT=0)
+    def test_resolved_once_per_request(self):
+        # the post renders the account page through get, both use the same customer
+        self.assertEqual(len(self.customer_queries('post', reverse('my_account'), {'trust': 'other'})), 1)
+        self.assertTrue(TrustedCustomer.objects.filter(username=self.customer, trusted_username=self.other).exists())
+
+    def test_cached_until_saved(self):
+        book = create_book('1000000000001')
+        self.assertEqual(len(self.customer_queries('get', reverse('my_order'))), 1)
+        self.assertEqual(len(self.customer_queries('get', reverse('my_order'))), 0)
+        self.customer.banned = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.save()
+        response = self.client.post(reverse('book_detail', args=[book.isbn]),
+                                    {'comment_textarea': 'text', 'scores': 5})
+        self.assertContains(response, 'You are banned')
+
+    def test_not_a_customer(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+
+# the most queries each view may issue in the tests below, first visits included
+QUERY_BUDGETS = {
+    'home': 8,
+    'book_search': 6,
+    'book_detail': 8,
+    'shopping_cart': 4,
+    'my_account': 6,
+    'my_order': 5,
+    'my_question': 4,
+    'degree_of_separation_search': 3,
+}
+
+
+@override_settings(QUERY_BUDGETS=QUERY_BUDGETS, QUERY_BUDGETS_RAISE=True)
+class QueryBudgetTest(TestCase):
+    def setUp(self):
+        clear_caches()
+        view_stats.clear()
+        self.customer = create_customer('buyer')
+        self.book = create_book('1000000000001')
+        Author.objects.create(isbn=self.book, first_name='First', last_name='Last')
+        Comment.objects.create(username=create_customer('critic'), isbn=self.book, score=5, comment_text='text')
+        add_to_cart(self.customer, self.book.isbn)
+        BookInOrder.objects.create(order_number=BookOrder.objects.create(username=self.customer, total_price=10),
+                                   isbn=self.book, count=1)
+        self.client.force_login(self.customer)
+
+    def test_views_within_budget(self):
+        urls = [reverse('home'), reverse('book_search'), reverse('book_search') + '?book_search=&title=Book',
+                reverse('book_detail', args=[self.book.isbn]), reverse('shopping_cart'), reverse('my_account'),
+                reverse('my_order'), reverse('my_question'), reverse('degree_of_separation_search')]
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        summary = view_stats.summary()
+        self.assertEqual(summary['book_search']['wall_time']['count'], 2)
+        self.assertGreater(summary['book_detail']['queries'][0.5], 0)
+        self.assertGreater(summary['book_detail']['template_time'][0.5], 0)
+
+    @override_settings(QUERY_BUDGETS={'home': 0})
+    def test_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('home'))
+
+    def test_stats_page(self):
+        self.client.get(reverse('home'))
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        self.assertContains(self.client.get(reverse('admin_view_stats')), '<td>home</td>')
+        response = self.client.get(reverse('admin_view_stats'), {'format': 'prometheus'})
+        self.assertContains(response, 'bookstore_view_queries_count{view="home"} 1')
+        self.assertContains(response, 'bookstore_view_wall_time{view="home",quantile="0.95"}')
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('admin_view_stats')).status_code, 302)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, quantile) for quantile in (0.5, 0.95, 0.99)], [50, 95, 99])
+        self.assertEqual(percentile([7], 0.5), 7)
+        self.assertEqual(percentile([], 0.5), 0)
+
+
+class BenchmarkCommandsTest(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_generate_and_benchmark(self):
+        call_command('generate_synthetic_data', books=200, authors=50, customers=20, orders=100, comments=150,
+                     trust_edges=40, batch_size=64, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 200)
+        self.assertEqual(Customer.objects.count(), 20)
+        self.assertEqual(BookOrder.objects.count(), 100)
+        self.assertEqual(Comment.objects.count(), 150)
+        self.assertFalse(Comment.objects.filter(commentvote__username=F('username')).exists())
+        self.assertTrue(self.client.login(username='synthetic0', password='password'))
+        # derived tables are rebuilt
+        self.assertEqual(BestSeller.objects.aggregate(total=Sum('total_quantity'))['total'],
+                         BookInOrder.objects.aggregate(total=Sum('count'))['total'])
+        self.assertEqual(BookSearchDocument.objects.count(), 200)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('run_benchmarks', requests=2, output=output, stdout=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+        self.assertEqual(report['rows']['Book'], 200)
+        self.assertLessEqual(report['views']['book_detail']['queries'], QUERY_BUDGETS['book_detail'])
+        self.assertGreater(report['views']['home']['p95_ms'], 0)
+
+
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        clear_caches()
+        self.book = create_book('1234567890123')
+        Author.objects.create(isbn=self.book, first_name='First', last_name='Last')
+        self.customer = create_customer('viewer')
+        ShoppingCart.objects.create(username=self.customer, isbn=self.book, count=1)
+        place_order(self.customer)
+        add_comment(create_customer('author'), self.book.isbn, 7, 'text')
+        self.client.force_login(self.customer)
+        self.async_client.force_login(self.customer)
+
+    # the async client's coroutines are called from the synchronous test through a coroutine function
+    async def async_get(self, path):
+        return await self.async_client.get(path)
+
+    def test_same_context_as_synchronous_views(self):
+        for name, arguments in [('home', []), ('book_detail', [self.book.isbn])]:
+            expected = self.client.get(reverse(name, args=arguments)).context
+            clear_caches()
+            response = async_to_sync(self.async_get)(reverse(f'async_{name}', args=arguments))
+            self.assertEqual(response.status_code, 200)
+            for key in ['most_purchased_books', 'recommended_books', 'comments', 'trust_status', 'authors']:
+                if key in expected:
+                    self.assertEqual(list(response.context[key]), list(expected[key]), key)
+        response = async_to_sync(self.async_get)(reverse('async_book_detail', args=['0000000000000']))
+        self.assertEqual(response.status_code, 404)
+        self.client.logout()
+        self.async_client.logout()
+        # the anonymous page cache is not applied to the async views
+        self.assertTrue(self.client.get(reverse('book_search')).has_header('ETag'))
+        response = async_to_sync(self.async_get)(reverse('async_book_search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_index_of_user_without_customer(self):
+        admin = User.objects.create_superuser('admin', password='password')
+        self.client.force_login(admin)
+        self.async_client.force_login(admin)
+        expected = list(self.client.get(reverse('home')).context['recommended_books'])
+        response = async_to_sync(self.async_get)(reverse('async_home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['recommended_books']), expected)
+        self.assertTrue(expected)
+
+    def test_benchmark(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark_asgi', requests=2, concurrency=2, latency=0, output=output, stdout=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+        self.assertEqual(set(report['views']), {'home', 'book_detail', 'book_search', 'degree_of_separation_search'})
+        self.assertGreater(report['views']['home']['asgi']['requests_per_second'], 0)
+
+
+class ConnectionPoolTest(TestCase):
+    class Raw:
+        def __init__(self):
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    def test_size_and_overflow(self):
+        pool = ConnectionPool(size=2, overflow=1, timeout=0.05)
+        raws = [pool.acquire(self.Raw) for _ in range(3)]
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.Raw)
+        for raw in raws:
+            pool.release(raw)
+        # the overflow connection is closed once returned
+        self.assertEqual([raw.closed for raw in raws], [False, False, True])
+        self.assertEqual(pool.stats()['idle'], 2)
+        self.assertIs(pool.acquire(self.Raw), raws[1])
+        # connections failing the check are replaced
+        self.assertIsNot(pool.acquire(self.Raw, check=lambda raw: False), raws[0])
+        self.assertTrue(raws[0].closed)
+        self.assertEqual(pool.stats()['opened'], 2)
+
+    def test_pooled_sqlite_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {**connection.settings_dict, 'ENGINE': 'home.db_backends.sqlite3',
+                             'NAME': os.path.join(directory, 'pool.sqlite3'), 'CONN_MAX_AGE': 0,
+                             'HEALTH_CHECKS': True, 'POOL': {'SIZE': 1, 'OVERFLOW': 0, 'TIMEOUT': 1}}
+            first, second = [load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, 'pool')
+                             for _ in range(2)]
+            try:
+                first.ensure_connection()
+                raw = first.connection
+                first.close()
+                second.ensure_connection()
+                self.assertIs(second.connection, raw)
+                second.close()
+                # a connection the server dropped is not handed out again
+                raw.close()
+                first.ensure_connection()
+                self.assertIsNot(first.connection, raw)
+                first.close()
+                self.assertEqual(get_pool(settings_dict).stats()['failed_checks'], 1)
+            finally:
+                close_pools()
+
+
+class SalesReportTest(TestCase):
+    def setUp(self):
+        self.customer = create_customer('buyer')
+        self.books = [create_book('1000000000001'), create_book('1000000000002')]
+        Book.objects.filter(isbn=self.books[1].isbn).update(publisher='Other')
+        Author.objects.create(isbn=self.books[0], first_name='Ann', last_name='Lee')
+        Author.objects.create(isbn=self.books[1], first_name='Ann', last_name='Lee')
+        Author.objects.create(isbn=self.books[1], first_name='Bo', last_name='Ng')
+        for counts in ([2, 1], [1, 0]):
+            for book, count in zip(self.books, counts):
+                if count:
+                    add_to_cart(self.customer, book.isbn)
+                    ShoppingCart.objects.filter(username=self.customer, isbn=book).update(count=count)
+            place_order(self.customer)
+
+    def rollups(self):
+        return (sorted(DailyBookSales.objects.values_list('day', 'isbn', 'quantity')),
+                sorted(DailyAuthorSales.objects.values_list('day', 'first_name', 'last_name', 'quantity')),
+                sorted(DailyPublisherSales.objects.values_list('day', 'publisher', 'quantity')))
+
+    def test_rollups_follow_checkout(self):
+        today = timezone.localdate()
+        books, authors, publishers = self.rollups()
+        self.assertEqual(books, [(today, '1000000000001', 3), (today, '1000000000002', 1)])
+        self.assertEqual(authors, [(today, 'Ann', 'Lee', 4), (today, 'Bo', 'Ng', 1)])
+        self.assertEqual(publishers, [(today, 'Other', 1), (today, 'Publisher', 3)])
+        # the backfill computes the same rows from the orders
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), (books, authors, publishers))
+
+    def test_report_window(self):
+        DailyBookSales.objects.create(day=timezone.localdate() - timedelta(days=30), isbn=self.books[1], quantity=5)
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        url = reverse('admin_book_report')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'number': 1, 'days': 7, 'top_books': ''})
+        # one read of the rollups, the orders are not touched
+        self.assertEqual(len([query for query in queries if 'home_dailybooksales' in query['sql']]), 1)
+        self.assertFalse([query for query in queries if 'home_bookinorder' in query['sql']])
+        self.assertEqual([row['isbn'] for row in response.context['results']], ['1000000000001'])
+        response = self.client.post(url, {'number': 1, 'days': 31, 'top_books': ''})
+        self.assertEqual([row['isbn'] for row in response.context['results']], ['1000000000002'])
+        response = self.client.post(url, {'number': 2, 'top_authors': ''})
+        self.assertEqual([(row['last_name'], row['count']) for row in response.context['results']],
+                         [('Lee', 4), ('Ng', 1)])
+        self.assertContains(self.client.post(url, {'number': 1, 'days': 0, 'top_books': ''}),
+                            'Please enter a positive integer')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'reads SQLite query plans')
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        clear_caches()
+        call_command('generate_synthetic_data', books=2000, authors=600, customers=200, orders=1000, comments=2000,
+                     trust_edges=400, stdout=StringIO())
+        # the planner decides with statistics, as it would on a live database
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    # the tables read without an index, a full scan of an index is fine for ordered reads that stop at a limit
+    @staticmethod
+    def table_scans(queryset):
+        return [line for line in queryset.explain().splitlines() if re.search(r'\bSCAN \w+$', line)]
+
+    def test_hot_queries_use_indexes(self):
+        book = Book.objects.order_by('isbn')[100]
+        author = Author.objects.order_by('id').first()
+        customer = Customer.objects.order_by('pk').first()
+        first_day = timezone.localdate() - timedelta(days=90)
+        queries = {
+            'search by publisher': Book.objects.filter(publisher=book.publisher).order_by('isbn'),
+            'search by subject by date': Book.objects.filter(subject=book.subject)
+                .order_by('publication_date', 'isbn'),
+            'search by language by date': Book.objects.filter(language=book.language)
+                .order_by('publication_date', 'isbn')[:SEARCH_PAGE_SIZE + 1],
+            'search by keywords': Book.objects.filter(keywords=book.keywords).order_by('isbn'),
+            'search by title': Book.objects.filter(title=book.title).order_by('isbn'),
+            'search by author': Book.objects.filter(author__first_name=author.first_name,
+                                                    author__last_name=author.last_name).order_by('isbn'),
+            'sort by date': Book.objects.order_by('publication_date', 'isbn')[:SEARCH_PAGE_SIZE + 1],
+            'sort by score': Book.objects.order_by('average_score', 'isbn')[:SEARCH_PAGE_SIZE + 1],
+            'sort by trusted score': trusted_score_books(customer.pk, {'publisher': book.publisher})
+                .order_by('avg_score', 'isbn'),
+            'author choices': Author.objects.values_list('first_name', 'last_name').order_by('last_name').distinct(),
+            'subject choices': Book.objects.values_list('subject', flat=True).order_by('subject').distinct(),
+            'most useful comments': Comment.objects.filter(isbn=book).select_related('username')
+                .order_by('-usefulness_score', '-id')[:11],
+            'order history': BookOrder.objects.filter(username=customer).order_by('-order_number')[:21],
+            'orders in a range': BookOrder.objects.filter(order_time__gte=timezone.now() - timedelta(days=7)),
+            'top books': DailyBookSales.objects.filter(day__gte=first_day).values('isbn', 'isbn__title')
+                .annotate(count=Sum('quantity')).order_by('-count', 'isbn')[:10],
+            'top authors': DailyAuthorSales.objects.filter(day__gte=first_day).values('first_name', 'last_name')
+                .annotate(count=Sum('quantity')).order_by('-count', 'last_name', 'first_name')[:10],
+            'top publishers': DailyPublisherSales.objects.filter(day__gte=first_day).values('publisher')
+                .annotate(count=Sum('quantity')).order_by('-count', 'publisher')[:10],
+            'top trusted': Customer.objects.values('username', 'net_trust').order_by('-net_trust', 'user_ptr')[:10],
+            'top useful': Customer.objects.values('username', 'average_usefulness')
+                .order_by('-average_usefulness', 'user_ptr')[:10],
+            'best sellers': BestSeller.objects.values('isbn', 'total_quantity', title=F('isbn__title'))
+                .order_by('-total_quantity', 'isbn')[:10],
+            'recommendations': BookNeighbor.objects.filter(isbn=book).order_by('-score')[:10],
+            'cart': ShoppingCart.objects.filter(username=customer).values('isbn', title=F('isbn__title')),
+            'trust sets': TrustedCustomer.objects.filter(username=customer).values_list('trusted_username'),
+        }
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                self.assertEqual(self.table_scans(queryset), [])
+
+
+class OrderHistoryTest(TestCase):
+    def setUp(self):
+        self.customer = create_customer('buyer')
+        self.books = [create_book(f'100000000000{i}') for i in range(3)]
+        self.client.force_login(self.customer)
+        self.client.get(reverse('home'))
+
+    def add_orders(self, n):
+        for _ in range(n):
+            order = BookOrder.objects.create(username=self.customer, total_price=30)
+            BookInOrder.objects.bulk_create([BookInOrder(order_number=order, isbn=book, count=1)
+                                             for book in self.books])
+
+    def test_query_count_independent_of_order_count(self):
+        self.add_orders(1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('my_order'))
+        self.add_orders(10)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('my_order'))
+        self.assertEqual(len(many), len(few))
+        self.assertContains(response, 'Book 1000000000002')
+
+    def test_keyset_pagination(self):
+        self.add_orders(5)
+        seen = []
+        orders, before = get_order_history(self.customer, page_size=2)
+        while True:
+            seen += [order.order_number for order in orders]
+            if before is None:
+                break
+            orders, before = get_order_history(self.customer, before, page_size=2)
+        expected = list(BookOrder.objects.order_by('-order_number').values_list('order_number', flat=True))
+        self.assertEqual(seen, expected)
+
+
+class RecommendationTest(TestCase):
+    def setUp(self):
+        self.books = [create_book(f'100000000000{i}') for i in range(5)]
+
+    def buy(self, customer, *books):
+        for book in books:
+            ShoppingCart.objects.create(username=customer, isbn=book, count=1)
+        place_order(customer)
+
+    def test_compute_neighbors(self):
+        neighbors = compute_neighbors({1: {'a', 'b'}, 2: {'a', 'b', 'c'}, 3: {'c'}})
+        self.assertEqual(neighbors['a'][0], ('b', 1.0))
+        self.assertEqual({isbn for isbn, _ in neighbors['c']}, {'a', 'b'})
+
+    def test_incremental_build_matches_full_build(self):
+        first, second, viewer = create_customer('first'), create_customer('second'), create_customer('viewer')
+        self.buy(first, self.books[0], self.books[1])
+        build_neighbors()
+        self.buy(second, self.books[0], self.books[2])
+        self.buy(first, self.books[3])
+        self.assertEqual(build_neighbors(), 4)
+        incremental = set(BookNeighbor.objects.values_list('isbn', 'neighbor', 'score'))
+        build_neighbors(full=True)
+        self.assertEqual(set(BookNeighbor.objects.values_list('isbn', 'neighbor', 'score')), incremental)
+
+        self.buy(viewer, self.books[2])
+        build_neighbors()
+        recommended = [book['isbn'] for book in recommend_books(viewer, limit=3)]
+        self.assertEqual(recommended, [self.books[0].isbn, self.books[1].isbn, self.books[3].isbn])
+
+    def test_incremental_build_rescores_books_sharing_buyers(self):
+        first, second = create_customer('first'), create_customer('second')
+        self.buy(first, self.books[0], self.books[1])
+        build_neighbors()
+        # only book 1 gains a buyer, which lowers its similarity to book 0 as seen from book 0 as well
+        self.buy(second, self.books[1], self.books[2])
+        build_neighbors()
+        incremental = set(BookNeighbor.objects.values_list('isbn', 'neighbor', 'score'))
+        build_neighbors(full=True)
+        self.assertEqual(set(BookNeighbor.objects.values_list('isbn', 'neighbor', 'score')), incremental)
+
+
+# run `work` for every item in its own thread, all released at once, retrying SQLite lock errors
+def run_concurrently(work, items):
+    barrier = threading.Barrier(len(items))
+
+    def run(item):
+        barrier.wait()
+        deadline = time.monotonic() + 30
+        attempt = 0
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    return work(item)
+                except OperationalError:
+                    # SQLite reports lock contention instead of blocking, retry after a random delay that grows so
+                    # that the threads stop colliding
+                    attempt += 1
+                    time.sleep(random.uniform(0.001, 0.01 * 2 ** min(attempt, 6)))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=run, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ConcurrentRatingTest(TransactionTestCase):
+    VOTERS = 20
+
+    def test_no_lost_ratings(self):
+        book = create_book('1000000000001')
+        comment = add_comment(create_customer('author'), book.isbn, 5, 'text')
+        voters = [create_customer(f'voter{i}') for i in range(self.VOTERS)]
+        run_concurrently(lambda voter: rate_comment(voter, book.isbn, comment.id,
+                                                    'very_useful' if voter.pk % 2 else 'useless'), voters)
+        comment.refresh_from_db()
+        very_useful = len([voter for voter in voters if voter.pk % 2])
+        self.assertEqual(comment.very_useful_count, very_useful)
+        self.assertEqual(comment.useless_count, self.VOTERS - very_useful)
+        self.assertEqual(comment.usefulness_score, very_useful * 2 / self.VOTERS)
+        self.assertEqual(CommentVote.objects.filter(comment=comment).count(), self.VOTERS)
+        author = Customer.objects.get(pk=comment.username_id)
+        self.assertAlmostEqual(author.usefulness_sum, comment.usefulness_score)
+        self.assertAlmostEqual(author.average_usefulness, comment.usefulness_score)
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    STOCK = 5
+    BUYERS = 20
+
+    def test_no_oversell(self):
+        book = create_book('1000000000001', stock_level=self.STOCK)
+        customers = []
+        for i in range(self.BUYERS):
+            customer = create_customer(f'buyer{i}')
+            ShoppingCart.objects.create(username=customer, isbn=book, count=1)
+            customers.append(customer)
+
+        outcomes = []
+
+        def checkout(customer):
+            try:
+                outcomes.append(place_order(customer))
+            except InsufficientStock:
+                outcomes.append(None)
+
+        run_concurrently(checkout, customers)
+
+        sold = BookInOrder.objects.filter(isbn=book).aggregate(total=Sum('count'))['total']
+        self.assertEqual(len(outcomes), self.BUYERS)
+        self.assertEqual(len([order for order in outcomes if order is not None]), self.STOCK)
+        self.assertEqual(sold, self.STOCK)
+        self.assertEqual(Book.objects.get(isbn=book.isbn).stock_level, 0)
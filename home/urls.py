@@ -1,6 +1,6 @@
 from django.urls import path, include
 
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('', views.index, name='home'),
@@ -14,5 +14,13 @@ urlpatterns = [
     path('book/<str:isbn_str>', views.book_detail, name='book_detail'),
     path('degree_of_separation_search', views.DegreeOfSeparationSearchView.as_view(), name='degree_of_separation_search'),
     path('admin_user_report', views.AdminUserStatView.as_view(), name='admin_user_report'),
-    path('admin_book_report', views.AdminBookStatView.as_view(), name='admin_user_report'),
+    path('admin_book_report', views.AdminBookStatView.as_view(), name='admin_book_report'),
+    path('admin_view_stats', views.admin_view_stats, name='admin_view_stats'),
+    path('admin_cache_stats', views.admin_cache_stats, name='admin_cache_stats'),
+    # the read only catalog pages as async views, for ASGI servers
+    path('async/', async_views.index, name='async_home'),
+    path('async/book_search', async_views.book_search, name='async_book_search'),
+    path('async/book/<str:isbn_str>', async_views.book_detail, name='async_book_detail'),
+    path('async/degree_of_separation_search', async_views.degree_of_separation_search,
+         name='async_degree_of_separation_search'),
 ]
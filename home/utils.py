@@ -1,51 +1,351 @@
-from django.db import transaction
-from django.db.models import F, Avg
+import csv
+import hashlib
+import json
+from collections import Counter
+from decimal import Decimal
+from functools import reduce
+from itertools import chain
+from operator import or_
+
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Avg, Q, Case, When, Prefetch, Sum, Count, OuterRef, Subquery, FloatField
+from django.db.models.functions import Coalesce, Cast, NullIf, TruncDate
 from django.forms import model_to_dict
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, HttpResponse
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.contrib import messages
 
+from .caching import get_or_compute, get_version, bump_version, trust_version, cart_version, book_version, \
+    CATALOG_VERSION, COMMENT_VERSION, SALES_VERSION, CATALOG_TIER, USER_TIER
 from .models import *
 from .forms import *
+from .search import search_books
+
+
+USEFULNESS_WEIGHTS = {'very_useful': 2, 'useful': 1, 'useless': 0}
+RATING_COUNT_FIELDS = {'very_useful': 'very_useful_count', 'useful': 'useful_count', 'useless': 'useless_count'}
+SEARCH_PAGE_SIZE = 50
+# how many of the most useful comments a book page can show at once, the first is the default
+COMMENT_COUNT_CHOICES = (10, 5, 25, 50)
+SEARCH_RESULT_FIELDS = ('title', 'isbn', 'publisher', 'subject', 'keywords', 'language', 'price')
+SEARCH_EXPORT_FORMATS = ('csv', 'json')
+
+
+# a file-like object whose write returns the line, so csv.writer can produce lines for a streaming response
+class Echo:
+    def write(self, value):
+        return value
 
 
 # render shopping cart for a authenticated user
 def render_shopping_cart(request):
-    current_customer = Customer.objects.get(username=request.user.username)
-    books_in_shopping_cart = ShoppingCart.objects.filter(username=current_customer) \
-        .values('isbn', 'count', title=F('isbn__title'), price=F('isbn__price'))
+    summary = get_cart_summary(request.user.pk)
     context = {
-        'books_in_shopping_cart': books_in_shopping_cart,
-        'total_price': 0,
+        'books_in_shopping_cart': summary['lines'],
+        'total_price': summary['total'],
     }
-    if books_in_shopping_cart.exists():
-        for book in books_in_shopping_cart:
-            context['total_price'] += book['price'] * book['count']
     return render(request, 'shopping_cart.html', context=context)
 
 
-# create or update the trust status
+# the lines, item count and total price of a customer's cart, cached until the cart or the catalog changes
+# every cart write goes through the helpers below, which bump the cart version explicitly; ShoppingCart has no
+# signal receivers so that deleting a cart stays a single statement
+def get_cart_summary(customer_pk):
+    def compute():
+        lines = list(ShoppingCart.objects.filter(username_id=customer_pk).order_by('isbn')
+                     .values('isbn', 'count', title=F('isbn__title'), price=F('isbn__price')))
+        return {
+            'lines': lines,
+            'count': sum(line['count'] for line in lines),
+            'total': sum((line['price'] * line['count'] for line in lines), Decimal(0)),
+        }
+
+    return get_or_compute(f'cart:{customer_pk}:{get_version(CATALOG_VERSION)}', cart_version(customer_pk), compute,
+                          USER_TIER)
+
+
+# add one copy of a book to a customer's cart in one statement: insert the line with a count of 1, or increase the
+# count if the line exists; nothing is inserted for an unknown isbn, in which case False is returned
+def add_to_cart(customer, isbn):
+    qn = connection.ops.quote_name
+    cart, book = ShoppingCart._meta, Book._meta
+    username, isbn_column = cart.get_field('username').column, cart.get_field('isbn').column
+    insert = (f'INSERT INTO {qn(cart.db_table)} ({qn(username)}, {qn(isbn_column)}, {qn("count")}) '
+              f'SELECT %s, {qn(book.pk.column)}, 1 FROM {qn(book.db_table)} WHERE {qn(book.pk.column)} = %s ')
+    if connection.vendor == 'mysql':
+        upsert = f'ON DUPLICATE KEY UPDATE {qn("count")} = {qn("count")} + 1'
+    else:
+        upsert = (f'ON CONFLICT ({qn(username)}, {qn(isbn_column)}) '
+                  f'DO UPDATE SET {qn("count")} = {qn(cart.db_table)}.{qn("count")} + 1')
+    with connection.cursor() as cursor:
+        cursor.execute(insert + upsert, [customer.pk, isbn])
+        added = cursor.rowcount > 0
+    if added:
+        bump_version(cart_version(customer.pk))
+    return added
+
+
+# increase or decrease the count of a line in a customer's cart with conditional statements,
+# a line decreased from 1 is removed
+def change_cart_quantity(customer, isbn, action):
+    line = ShoppingCart.objects.filter(username=customer, isbn=isbn)
+    if action == 'increase':
+        line.update(count=F('count') + 1)
+    elif action == 'decrease':
+        if not line.filter(count__gt=1).update(count=F('count') - 1):
+            line.filter(count__lte=1).delete()
+    bump_version(cart_version(customer.pk))
+
+
+# add amounts to counter rows, creating the missing rows first
+# `amounts` is a list of (lookup, amount) where lookup is a dict that identifies one row
+def bulk_increment(model, field, amounts):
+    if not amounts:
+        return
+    model.objects.bulk_create([model(**lookup) for lookup, _ in amounts], ignore_conflicts=True)
+    model.objects.filter(reduce(or_, [Q(**lookup) for lookup, _ in amounts])).update(
+        **{field: Case(*[When(Q(**lookup), then=F(field) + amount) for lookup, amount in amounts])})
+
+
+# add the copies of an order to the daily sales rollups of its day, `cart` maps isbn to count
+def add_daily_sales(day, books, cart):
+    authors, publishers = Counter(), Counter()
+    for isbn, first_name, last_name in Author.objects.filter(isbn__in=cart).values_list('isbn', 'first_name',
+                                                                                        'last_name'):
+        authors[first_name, last_name] += cart[isbn]
+    for book in books:
+        publishers[book.publisher] += cart[book.isbn]
+    bulk_increment(DailyBookSales, 'quantity', [({'day': day, 'isbn_id': isbn}, count) for isbn, count in cart.items()])
+    bulk_increment(DailyAuthorSales, 'quantity',
+                   [({'day': day, 'first_name': first_name, 'last_name': last_name}, count)
+                    for (first_name, last_name), count in authors.items()])
+    bulk_increment(DailyPublisherSales, 'quantity', [({'day': day, 'publisher': publisher}, count)
+                                                     for publisher, count in publishers.items()])
+
+
+# rebuild the daily sales rollups from the full order history
+def rebuild_daily_sales(batch_size=1000):
+    day = TruncDate('order_number__order_time')
+    rollups = [
+        (DailyBookSales, BookInOrder.objects.values('isbn_id', day=day)),
+        (DailyAuthorSales, BookInOrder.objects.filter(isbn__author__isnull=False)
+         .values(day=day, first_name=F('isbn__author__first_name'), last_name=F('isbn__author__last_name'))),
+        (DailyPublisherSales, BookInOrder.objects.values(day=day, publisher=F('isbn__publisher'))),
+    ]
+    with transaction.atomic():
+        for model, rows in rollups:
+            model.objects.all().delete()
+            model.objects.bulk_create((model(**row) for row in rows.annotate(quantity=Sum('count')).order_by()
+                                       .iterator()), batch_size=batch_size)
+
+
+# raised by place_order when the cart asks for more copies than are in stock
+class InsufficientStock(Exception):
+    def __init__(self, books):
+        super().__init__('insufficient stock')
+        # the locked Book rows that cannot cover the quantity in the cart
+        self.books = books
+
+
+# atomically turn a customer's shopping cart into an order, return None if the cart is empty
+def place_order(customer):
+    with transaction.atomic():
+        # the cart is locked first, so a second checkout of the same cart waits for this one and then finds it empty
+        cart = dict(ShoppingCart.objects.select_for_update().filter(username=customer).order_by('isbn')
+                    .values_list('isbn', 'count'))
+        if not cart:
+            return None
+        # lock every book in the cart at once, always in ISBN order so concurrent checkouts cannot deadlock
+        books = list(Book.objects.select_for_update().filter(isbn__in=cart).order_by('isbn'))
+        short = [book for book in books if cart[book.isbn] > book.stock_level]
+        if short:
+            raise InsufficientStock(short)
+        # one conditional UPDATE for all books; the stock guard makes overselling impossible even without the lock
+        in_stock = Q()
+        for isbn, count in cart.items():
+            in_stock |= Q(isbn=isbn, stock_level__gte=count)
+        updated = Book.objects.filter(in_stock).update(stock_level=Case(
+            *[When(isbn=isbn, then=F('stock_level') - count) for isbn, count in cart.items()]))
+        if updated != len(cart):
+            raise InsufficientStock(books)
+        total_price = sum(book.price * cart[book.isbn] for book in books)
+        order = BookOrder.objects.create(username=customer, total_price=total_price)
+        BookInOrder.objects.bulk_create([BookInOrder(order_number=order, isbn=book, count=cart[book.isbn])
+                                         for book in books])
+        bulk_increment(BestSeller, 'total_quantity', [({'isbn_id': isbn}, count) for isbn, count in cart.items()])
+        add_daily_sales(timezone.localdate(order.order_time), books, cart)
+        ShoppingCart.objects.filter(username=customer).delete()
+    bump_version(cart_version(customer.pk))
+    # the stock levels and the best sellers changed
+    for isbn in cart:
+        bump_version(book_version(isbn))
+    bump_version(SALES_VERSION)
+    return order
+
+
+# create or update the trust status, and keep the target's trust counters in step
 def change_customer_trust_status(current_customer, target_customer, action):
     with transaction.atomic():
         if action == 'trust':
-            TrustedCustomer.objects.get_or_create(username=current_customer,
-                                                  trusted_username=target_customer)
-            try:
-                untrust = UntrustedCustomer.objects.get(username=current_customer,
-                                                        untrusted_username=target_customer)
-                untrust.delete()
-            except UntrustedCustomer.DoesNotExist:
-                pass
+            _, created = TrustedCustomer.objects.get_or_create(username=current_customer,
+                                                               trusted_username=target_customer)
+            removed, _ = UntrustedCustomer.objects.filter(username=current_customer,
+                                                          untrusted_username=target_customer).delete()
+            trust_change, untrust_change = int(created), -removed
         elif action == 'untrust':
-            UntrustedCustomer.objects.get_or_create(username=current_customer,
-                                                    untrusted_username=target_customer)
+            _, created = UntrustedCustomer.objects.get_or_create(username=current_customer,
+                                                                 untrusted_username=target_customer)
+            removed, _ = TrustedCustomer.objects.filter(username=current_customer,
+                                                        trusted_username=target_customer).delete()
+            trust_change, untrust_change = -removed, int(created)
+        else:
+            return
+        if trust_change or untrust_change:
+            Customer.objects.filter(pk=target_customer.pk).update(
+                trust_count=F('trust_count') + trust_change,
+                untrust_count=F('untrust_count') + untrust_change,
+                net_trust=F('net_trust') + trust_change - untrust_change)
+
+
+# get the pks of the customers a customer trusts and untrusts, cached until the customer's trust changes
+def get_trust_sets(customer):
+    def compute():
+        trusted = set(TrustedCustomer.objects.filter(username=customer).values_list('trusted_username', flat=True))
+        untrusted = set(UntrustedCustomer.objects.filter(username=customer)
+                        .values_list('untrusted_username', flat=True))
+        return trusted, untrusted
+
+    return get_or_compute(f'trust_sets:{customer.pk}', trust_version(customer.pk), compute, USER_TIER)
+
+
+# books matching a search annotated with the average score given by the customers the viewer trusts,
+# computed in the same aggregate query
+def trusted_score_books(viewer_pk, data):
+    trusted = TrustedCustomer.objects.filter(username=viewer_pk).values('trusted_username')
+    return Book.objects.filter(**data).values(*SEARCH_RESULT_FIELDS) \
+        .annotate(avg_score=Coalesce(Avg('comment__score', filter=Q(comment__username__in=trusted)), 0.0))
+
+
+# raised by rate_comment when the customer may not rate the comment
+class CannotRateComment(Exception):
+    pass
+
+
+# the usefulness score of a comment is the average of its ratings, where very useful counts 2, useful 1 and useless 0
+# the counts may be F() expressions, so the score can be computed inside an UPDATE
+def usefulness_score(very_useful_count, useful_count, useless_count):
+    return Cast(very_useful_count * USEFULNESS_WEIGHTS['very_useful'] + useful_count * USEFULNESS_WEIGHTS['useful']
+                + useless_count * USEFULNESS_WEIGHTS['useless'], FloatField()) \
+           / (very_useful_count + useful_count + useless_count)
+
+
+# add one rating to a comment of the book `isbn` with a single UPDATE, so concurrent ratings are never lost
+# with COMMENT_VOTE_LEDGER each customer may rate a comment once, enforced by the ledger's unique constraint
+def rate_comment(customer, isbn, comment_id, rating):
+    counts = {field: F(field) for field in RATING_COUNT_FIELDS.values()}
+    counts[RATING_COUNT_FIELDS[rating]] += 1
+    with transaction.atomic():
+        # usefulness_score comes first since MySQL evaluates SET assignments left to right on the updated row
+        updated = Comment.objects.filter(id=comment_id, isbn=isbn).exclude(username=customer).update(
+            usefulness_score=usefulness_score(**counts), **counts)
+        if not updated:
+            if Comment.objects.filter(id=comment_id, isbn=isbn).exists():
+                raise CannotRateComment('You cannot rate your own comment!')
+            raise Comment.DoesNotExist
+        add_usefulness_change(comment_id, RATING_COUNT_FIELDS[rating])
+        if settings.COMMENT_VOTE_LEDGER:
             try:
-                trust = TrustedCustomer.objects.get(username=current_customer,
-                                                    trusted_username=target_customer)
-                trust.delete()
-            except TrustedCustomer.DoesNotExist:
-                pass
+                with transaction.atomic():
+                    CommentVote.objects.create(comment_id=comment_id, username=customer, rating=rating)
+            except IntegrityError:
+                # rolls back the UPDATE above
+                raise CannotRateComment('You have already rated this comment!')
+    # the comment's counts changed with an UPDATE, which sends no signal
+    bump_version(book_version(isbn))
+
+
+# fold the change of a comment's usefulness score after one more rating into its author's usefulness aggregates
+# the UPDATE of the comment keeps its row locked, so the counts read here are the ones after this rating
+def add_usefulness_change(comment_id, rated_field):
+    counts = {field: F(field) for field in RATING_COUNT_FIELDS.values()}
+    counts[rated_field] -= 1
+    # the score before the rating, 0 for a comment that had no ratings
+    previous = Case(When(**{field: 0 for field in RATING_COUNT_FIELDS.values() if field != rated_field},
+                         **{rated_field: 1}, then=0.0),
+                    default=usefulness_score(**counts), output_field=FloatField())
+    comment = Comment.objects.filter(id=comment_id)
+    change = Subquery(comment.values(change=F('usefulness_score') - previous), output_field=FloatField())
+    # average_usefulness comes first since MySQL evaluates SET assignments left to right on the updated row
+    Customer.objects.filter(pk=Subquery(comment.values('username'))).update(
+        average_usefulness=average_usefulness(F('usefulness_sum') + change, F('comment_count')),
+        usefulness_sum=F('usefulness_sum') + change)
+
+
+# fold comments written (count 1) or deleted (count -1) with their usefulness into their author's aggregates
+def add_customer_comments(customer_pk, count, usefulness):
+    # average_usefulness comes first since MySQL evaluates SET assignments left to right on the updated row
+    Customer.objects.filter(pk=customer_pk).update(
+        average_usefulness=average_usefulness(F('usefulness_sum') + usefulness, F('comment_count') + count),
+        usefulness_sum=F('usefulness_sum') + usefulness,
+        comment_count=F('comment_count') + count)
+
+
+# the average usefulness of a customer's comments, 0 for a customer without comments
+def average_usefulness(usefulness_sum, comment_count):
+    return Coalesce(usefulness_sum / NullIf(comment_count, 0), 0.0, output_field=FloatField())
+
+
+# record a comment and fold its score into the book's rating aggregates in the same transaction, its author's
+# aggregates follow every comment through signals
+def add_comment(customer, isbn, score, comment_text):
+    score = int(score)
+    with transaction.atomic():
+        comment = Comment.objects.create(username=customer, isbn_id=isbn, score=score, comment_text=comment_text)
+        # average_score comes first since MySQL evaluates SET assignments left to right on the updated row
+        Book.objects.filter(isbn=isbn).update(
+            average_score=(Cast('rating_sum', FloatField()) + score) / (F('rating_count') + 1),
+            rating_sum=F('rating_sum') + score,
+            rating_count=F('rating_count') + 1)
+    return comment
+
+
+# recompute the rating aggregates of every book from the comments in one statement
+def reconcile_book_ratings():
+    comments = Comment.objects.filter(isbn=OuterRef('isbn')).order_by().values('isbn')
+    rating_sum = Coalesce(Subquery(comments.annotate(total=Sum('score')).values('total')), 0)
+    rating_count = Coalesce(Subquery(comments.annotate(total=Count('id')).values('total')), 0)
+    average_score = Coalesce(Subquery(comments.annotate(average=Avg('score')).values('average'),
+                                      output_field=FloatField()), 0.0)
+    return Book.objects.update(rating_sum=rating_sum, rating_count=rating_count, average_score=average_score)
+
+
+# recompute the usefulness score of every rated comment from its rating counts
+def reconcile_usefulness_scores():
+    counts = {field: F(field) for field in RATING_COUNT_FIELDS.values()}
+    return Comment.objects.exclude(very_useful_count=0, useful_count=0, useless_count=0) \
+        .update(usefulness_score=usefulness_score(**counts))
+
+
+# recompute the trust and usefulness aggregates of every customer in one statement
+def reconcile_customer_aggregates():
+    def total(queryset, field, aggregate, default=0):
+        return Coalesce(Subquery(queryset.order_by().values(field).annotate(total=aggregate).values('total')), default)
+
+    trusts = total(TrustedCustomer.objects.filter(trusted_username=OuterRef('pk')), 'trusted_username', Count('id'))
+    untrusts = total(UntrustedCustomer.objects.filter(untrusted_username=OuterRef('pk')), 'untrusted_username',
+                     Count('id'))
+    comments = Comment.objects.filter(username=OuterRef('pk'))
+    return Customer.objects.update(
+        trust_count=trusts, untrust_count=untrusts, net_trust=trusts - untrusts,
+        usefulness_sum=total(comments, 'username', Sum('usefulness_score'), 0.0),
+        comment_count=total(comments, 'username', Count('id')),
+        average_usefulness=total(comments, 'username', Avg('usefulness_score'), 0.0))
 
 
 # render a book, plus the trust status if the user authenticated
@@ -55,34 +355,133 @@ def render_book_detail(request, isbn_str):
     except Book.DoesNotExist:
         raise Http404('ISBN does not exist')
 
-    authors = Author.objects.filter(isbn=isbn_str)
-    comments = Comment.objects.filter(isbn=isbn_str)
+    count, cursor = get_comment_page_request(request)
+    comments, next_cursor = get_top_comments(isbn_str, count, cursor)
+    current_customer = request.customer
+    trust_sets = get_trust_sets(current_customer) if current_customer else None
+    context = get_book_detail_context(book, Author.objects.filter(isbn=isbn_str), comments, next_cursor, count,
+                                      current_customer, trust_sets)
+    return render(request, 'book_detail.html', context=context)
+
+
+# the number of comments and the cursor a book page asks for with its n and after parameters
+def get_comment_page_request(request):
+    try:
+        count = int(request.GET['n'])
+    except (KeyError, ValueError):
+        count = COMMENT_COUNT_CHOICES[0]
+    if count not in COMMENT_COUNT_CHOICES:
+        count = COMMENT_COUNT_CHOICES[0]
+    try:
+        cursor = signing.loads(request.GET['after'])
+    except (KeyError, signing.BadSignature):
+        cursor = None
+    return count, cursor
+
+
+# the context of a book page, trust_sets are the viewing customer's (None for anonymous viewers)
+def get_book_detail_context(book, authors, comments, next_cursor, count, customer, trust_sets):
     context = {'book': book,
                'comments': comments,
+               'comment_count': count,
+               'comment_count_choices': sorted(COMMENT_COUNT_CHOICES),
+               'next_comments': signing.dumps(next_cursor) if next_cursor is not None else None,
                'authors': authors,
-               'book_dict': model_to_dict(book), }
+               'book_dict': model_to_dict(book, exclude=['rating_sum', 'rating_count', 'average_score']),
+               # the book header and author list are the same for every viewer and cached as fragments
+               'book_version': get_book_fragment_version(book.isbn),
+               'fragment_timeout': caches[CATALOG_TIER].default_timeout, }
 
-    if request.user.is_authenticated:
-        current_customer = Customer.objects.get(username=request.user.username)
+    if customer:
+        trusted, untrusted = trust_sets
         trust_status = {}
         for comment in comments:
-            if comment.username == current_customer:
+            if comment.username_id == customer.pk:
                 trust_status[comment.id] = 'self'
-                continue
-            try:
-                TrustedCustomer.objects.get(username=current_customer, trusted_username=comment.username)
+            elif comment.username_id in trusted:
                 trust_status[comment.id] = 'trust'
-                continue
-            except TrustedCustomer.DoesNotExist:
-                trust_status[comment.id] = ''
-            try:
-                UntrustedCustomer.objects.get(username=current_customer, untrusted_username=comment.username)
+            elif comment.username_id in untrusted:
                 trust_status[comment.id] = 'untrust'
-                continue
-            except UntrustedCustomer.DoesNotExist:
+            else:
                 trust_status[comment.id] = ''
-        context['trust_status'] = trust_status,
-    return render(request, 'book_detail.html', context=context)
+        context['trust_status'] = trust_status
+    return context
+
+
+# the version the cached header fragment of a book page is keyed by
+def get_book_fragment_version(isbn):
+    return f'{get_version(CATALOG_VERSION)}.{get_version(book_version(isbn))}'
+
+
+# the best selling books, most sold first
+def get_best_sellers(limit=10):
+    return BestSeller.objects.values('isbn', 'total_quantity', title=F('isbn__title'), price=F('isbn__price')) \
+               .order_by('-total_quantity', 'isbn')[:limit]
+
+
+# the most useful comments on a book with their authors, best first, starting after a cursor from a previous page
+# returns the comments and the (usefulness_score, id) cursor of the next page (None on the last page)
+def get_top_comments(isbn, count, cursor=None):
+    comments = Comment.objects.filter(isbn=isbn)
+    if cursor is not None:
+        score, comment_id = cursor
+        comments = comments.filter(Q(usefulness_score__lt=score) | Q(usefulness_score=score, id__lt=comment_id))
+    comments = list(comments.select_related('username').order_by('-usefulness_score', '-id')[:count + 1])
+    if len(comments) > count:
+        last = comments[count - 1]
+        return comments[:count], [last.usefulness_score, last.id]
+    return comments, None
+
+
+# one page of a queryset ordered by (sort_field, isbn), starting after a cursor from a previous page
+# returns the rows and the cursor of the next page (None on the last page)
+def get_keyset_page(queryset, sort_field, cursor=None):
+    page_size = SEARCH_PAGE_SIZE
+    if cursor is not None:
+        value, isbn = cursor
+        queryset = queryset.filter(Q(**{f'{sort_field}__gt': value}) | Q(**{sort_field: value, 'isbn__gt': isbn}))
+    rows = list(queryset.order_by(sort_field, 'isbn')[:page_size + 1])
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        return rows[:page_size], [str(last[sort_field]), last['isbn']]
+    return rows, None
+
+
+# one page of full-text matches, which are ranked in memory, so the cursor is a position in the ranking of the
+# matches that also pass the queryset's other filters
+def get_ranked_page(queryset, ranked_isbns, cursor=None):
+    page_size = SEARCH_PAGE_SIZE
+    start = cursor or 0
+    matched = set(queryset.filter(isbn__in=ranked_isbns).values_list('isbn', flat=True))
+    ranked_isbns = [isbn for isbn in ranked_isbns if isbn in matched]
+    page_isbns = ranked_isbns[start:start + page_size]
+    rows = {row['isbn']: row for row in queryset.filter(isbn__in=page_isbns)}
+    next_cursor = start + page_size if start + page_size < len(ranked_isbns) else None
+    return [rows[isbn] for isbn in page_isbns if isbn in rows], next_cursor
+
+
+# the context of the empty search form, whose rendering, with every author, subject and keyword as a choice, is
+# cached as a fragment until the catalog changes
+def search_form_context():
+    return {'form': BookSearchForm(),
+            'catalog_version': get_version(CATALOG_VERSION),
+            'fragment_timeout': caches[CATALOG_TIER].default_timeout}
+
+
+# stream every matching book as CSV or JSON without holding the results in memory
+def stream_book_search_result(queryset, export_format):
+    rows = queryset.iterator(chunk_size=2000)
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        header = [writer.writerow(SEARCH_RESULT_FIELDS + ('avg_score',))]
+        lines = (writer.writerow([row[field] for field in SEARCH_RESULT_FIELDS] + [row.get('avg_score', '')])
+                 for row in rows)
+        response = StreamingHttpResponse(chain(header, lines), content_type='text/csv')
+    else:
+        items = ((',' if i else '') + json.dumps(row, cls=DjangoJSONEncoder) for i, row in enumerate(rows))
+        response = StreamingHttpResponse(chain('[', items, ']'), content_type='application/json')
+    response['Content-Disposition'] = f'attachment; filename="books.{export_format}"'
+    return response
 
 
 # make book search queries
@@ -90,6 +489,7 @@ def render_book_search_result(request, form):
     data = form.cleaned_data
     order_by = ''
     author = ''
+    query = ''
     to_pop = []
     for key, value in data.items():
         if key == 'sort_by':
@@ -98,54 +498,94 @@ def render_book_search_result(request, form):
         elif key == 'author':
             author = value
             to_pop.append(key)
+        elif key == 'query':
+            query = value
+            to_pop.append(key)
         elif value == '':
             to_pop.append(key)
     [data.pop(key) for key in to_pop]
     if author != '':
         data['author__first_name'], data['author__last_name'] = author.split('_')
+    ranked_isbns = None
+    if query != '':
+        # full-text matches, most relevant first
+        ranked_isbns = search_books(query)
+        data['isbn__in'] = ranked_isbns
     context = {'order_by': order_by}
     # start query
-    if order_by != '':
-        if order_by == form.SORT_CHOICE['publication_date']:
-            result = Book.objects.filter(**data).order_by('publication_date')
-        elif order_by == form.SORT_CHOICE['score']:
-            result = Book.objects.filter(**data) \
-                .values('title', 'isbn', 'publisher', 'author__first_name', 'author__last_name', 'subject', 'keywords',
-                        'language', 'price') \
-                .annotate(avg_score=Avg('comment__score')).order_by('avg_score')
-        elif order_by == form.SORT_CHOICE['trusted_score']:
-            if request.user.is_authenticated:
-                result = Book.objects.filter(**data) \
-                    .values('title', 'isbn', 'publisher', 'author__first_name', 'author__last_name', 'subject',
-                            'keywords', 'language', 'price') \
-                    .annotate(avg_score=Avg('comment__score')).order_by('avg_score')
-                context['book_results'] = result
-                return render(request, 'book_search_result.html', context=context)
-            else:
-                # if customer is not logged in, then cannot sort by trusted customer
-                messages.info(request, mark_safe(
-                    f'You are not logged in, thus you cannot Sort by "{form.SORT_CHOICE["trusted_score"]}"<br>'))
-                context.pop('order_by')
-                context['form'] = BookSearchForm()
-            return render(request, 'book_search.html', context=context)
-        else:
-            return HttpResponse("Error")
-    else:
-        if author != '':
-            result = Book.objects.filter(**data) \
-                .values('title', 'isbn', 'publisher', 'author__first_name', 'author__last_name',
-                        'subject', 'keywords', 'language', 'price')
-        else:
-            result = Book.objects.filter(**data) \
-                .values('title', 'isbn', 'publisher', 'subject', 'keywords', 'language', 'price')
+    if order_by == '':
+        result = Book.objects.filter(**data).values(*SEARCH_RESULT_FIELDS)
+        sort_field = 'isbn'
         context.pop('order_by')
-    context['book_results'] = result
+    elif order_by == form.SORT_CHOICE['publication_date']:
+        result = Book.objects.filter(**data).values(*SEARCH_RESULT_FIELDS, 'publication_date')
+        sort_field = 'publication_date'
+        ranked_isbns = None
+    elif order_by == form.SORT_CHOICE['score']:
+        result = Book.objects.filter(**data).values(*SEARCH_RESULT_FIELDS, avg_score=F('average_score'))
+        sort_field = 'avg_score'
+        ranked_isbns = None
+    elif order_by == form.SORT_CHOICE['trusted_score']:
+        if not request.user.is_authenticated:
+            # if customer is not logged in, then cannot sort by trusted customer
+            messages.info(request, mark_safe(
+                f'You are not logged in, thus you cannot Sort by "{form.SORT_CHOICE["trusted_score"]}"<br>'))
+            return render(request, 'book_search.html', context=search_form_context())
+        result = trusted_score_books(request.user.pk, data)
+        sort_field = 'avg_score'
+        ranked_isbns = None
+    else:
+        return HttpResponse("Error")
+
+    export_format = request.GET.get('format')
+    if export_format in SEARCH_EXPORT_FORMATS:
+        return stream_book_search_result(result.order_by(sort_field, 'isbn'), export_format)
+
+    try:
+        cursor = signing.loads(request.GET['after'])
+    except (KeyError, signing.BadSignature):
+        cursor = None
+    if ranked_isbns is not None:
+        context['book_results'], next_cursor = get_ranked_page(result, ranked_isbns, cursor)
+    elif order_by == form.SORT_CHOICE['trusted_score']:
+        # pages are cached per viewer until the viewer's trust changes or a comment is written
+        search_key = hashlib.md5(repr((sorted(data.items()), cursor)).encode()).hexdigest()
+        context['book_results'], next_cursor = get_or_compute(
+            f'trusted_score:{request.user.pk}:{get_version(COMMENT_VERSION)}:{search_key}',
+            trust_version(request.user.pk), lambda: get_keyset_page(result, sort_field, cursor), USER_TIER)
+    else:
+        context['book_results'], next_cursor = get_keyset_page(result, sort_field, cursor)
+
+    # the same search as a query string, for the next page and export links
+    params = form.data.copy()
+    params.pop('csrfmiddlewaretoken', None)
+    params.pop('format', None)
+    params.pop('after', None)
+    params['book_search'] = ''
+    context['search_params'] = params.urlencode()
+    if next_cursor is not None:
+        params['after'] = signing.dumps(next_cursor)
+        context['next_page_params'] = params.urlencode()
     return render(request, 'book_search_result.html', context=context)
 
 
+# one page of a customer's orders, newest first, with their books prefetched
+# returns the orders and the order number to pass as `before` for the next page (None on the last page)
+def get_order_history(customer, before=None, page_size=20):
+    orders = BookOrder.objects.filter(username=customer)
+    if before is not None:
+        orders = orders.filter(order_number__lt=before)
+    lines = BookInOrder.objects.select_related('isbn').only('order_number', 'count', 'isbn__isbn', 'isbn__title')
+    orders = list(orders.order_by('-order_number')
+                  .prefetch_related(Prefetch('bookinorder_set', queryset=lines, to_attr='lines'))[:page_size + 1])
+    if len(orders) > page_size:
+        return orders[:page_size], orders[page_size - 1].order_number
+    return orders, None
+
+
 # render ask question page
 def render_ask_a_question(request):
-    current_customer = Customer.objects.get(username=request.user.username)
+    current_customer = request.customer
     previous_questions = Question.objects.filter(username=current_customer)
     context = {'form': CustomerQuestionForm(),
                'previous_questions': previous_questions}
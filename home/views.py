@@ -1,26 +1,29 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from django import views
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db import connection
-from django.db.models import Sum, Count
+from django.db.models import Sum
 from django.shortcuts import redirect
 from django.utils.decorators import method_decorator
 
+from .graph import get_coauthor_graph
+from .cache_backends import cache_stats, cache_prometheus_text, STATS
+from .caching import REPORTS_TIER
+from .instrumentation import view_stats, prometheus_text, METRICS, QUANTILES
+from .page_cache import cache_anonymous_page
+from .recommendations import recommend_books
 from .utils import *
 
 
 # Create your views here.
 
 # displays recommended books on the index page
+@cache_anonymous_page(lambda request: [CATALOG_VERSION, SALES_VERSION])
 def index(request):
-    most_purchased_books = Book.objects.values('isbn', 'title', 'price') \
-                               .annotate(total_quantity=Sum('bookinorder__count')).order_by('-total_quantity')[:10]
-    if request.user.is_authenticated and not request.user.is_superuser:
-        current_customer = Customer.objects.get(username=request.user.username)
-        recommended_books = Book.objects.exclude(bookinorder__order_number__username=current_customer) \
-                                .values('isbn', 'title', 'price')[:10]
+    most_purchased_books = get_best_sellers()
+    if request.customer:
+        recommended_books = recommend_books(request.customer)
     else:
         recommended_books = Book.objects.values('isbn', 'title', 'price')[:10]
     context = {'most_purchased_books': most_purchased_books,
@@ -28,13 +31,18 @@ def index(request):
     return render(request, 'index.html', context=context)
 
 
+# the blank search form is the same for every anonymous visitor; result pages are not cached, the scores they can be
+# sorted by change with every comment
+@cache_anonymous_page(lambda request: [CATALOG_VERSION])
+def blank_book_search(request):
+    return render(request, 'book_search.html', context=search_form_context())
+
+
 # get and clean search criteria
 def book_search(request):
-    blank_form = BookSearchForm()
-    blank_context = {'form': blank_form}
-
-    if request.method == 'POST':
-        form = BookSearchForm(request.POST)
+    # searches are submitted with GET so that result pages and exports can be linked, POST is still accepted
+    if request.method == 'POST' or 'book_search' in request.GET:
+        form = BookSearchForm(request.POST if request.method == 'POST' else request.GET)
         # good search
         if form.is_valid():
             return render_book_search_result(request, form)
@@ -43,61 +51,34 @@ def book_search(request):
             messages.error(request, "Error:")
             for _, error in form.errors.items():
                 messages.error(request, error)
-            return render(request, 'book_search.html', context=blank_context)
+            return render(request, 'book_search.html', context=search_form_context())
     else:
-        return render(request, 'book_search.html', context=blank_context)
+        return blank_book_search(request)
 
 
 @login_required(login_url='login')
 def shopping_cart(request):
-    current_customer = Customer.objects.get(username=request.user.username)
+    current_customer = request.customer
     if request.method == 'POST':
         # increase or decrease item count in the shopping cart
         if 'quantity_action' in request.POST:
-            action = request.POST.get('quantity_action')
-            isbn = request.POST.get('isbn')
-            book_in_cart = ShoppingCart.objects.get(username=current_customer, isbn=isbn)
-            if action == 'decrease':
-                if book_in_cart.count == 1:
-                    book_in_cart.delete()
-                else:
-                    book_in_cart.count -= 1
-                    book_in_cart.save()
-            elif action == 'increase':
-                book_in_cart.count += 1
-                book_in_cart.save()
+            change_cart_quantity(current_customer, request.POST.get('isbn'), request.POST.get('quantity_action'))
             return render_shopping_cart(request)
         # checkout
         elif 'check_out' in request.POST:
-            books_in_shopping_cart = ShoppingCart.objects.filter(username=current_customer) \
-                .values('isbn', 'count', title=F('isbn__title'), price=F('isbn__price'), stock=F('isbn__stock_level'))
-            quantity_too_large = False
-            # check if stock is enough
-            for book in books_in_shopping_cart:
-                if book['count'] > book['stock']:
-                    quantity_too_large = True
+            try:
+                order = place_order(current_customer)
+            except InsufficientStock as e:
+                # nothing was written, report every book that is short
+                for book in e.books:
                     messages.error(request, mark_safe(f'Unable to checkout:<br>&emsp;'
-                                                      f'Book "{book["title"]}" has only {book["stock"]} in stock<br>'))
-            if quantity_too_large:
+                                                      f'Book "{book.title}" has only {book.stock_level} in stock<br>'))
                 return render_shopping_cart(request)
-            else:
-                total_price = 0
-                for book in books_in_shopping_cart:
-                    total_price += book['price'] * book['count']
-                # atomically create an order and decrease stock
-                with transaction.atomic():
-                    order = BookOrder.objects.create(username=current_customer, total_price=total_price)
-                    for book in books_in_shopping_cart:
-                        book_in_order = BookInOrder.objects.create(order_number=order,
-                                                                   isbn=Book.objects.get(isbn=book['isbn']),
-                                                                   count=book['count'])
-                        book_in_stock = Book.objects.get(isbn=book['isbn'])
-                        book_in_stock.stock_level -= book['count']
-                        book_in_order.save()
-                        book_in_stock.save()
-                    ShoppingCart.objects.filter(username=current_customer).delete()
-                messages.info(request, mark_safe('Order placed successfully! You can view it in "My Order"<br>'))
+            if order is None:
+                messages.error(request, mark_safe('Unable to checkout: your shopping cart is empty<br>'))
                 return render_shopping_cart(request)
+            messages.info(request, mark_safe('Order placed successfully! You can view it in "My Order"<br>'))
+            return render_shopping_cart(request)
     else:
         return render_shopping_cart(request)
 
@@ -106,7 +87,7 @@ def shopping_cart(request):
 class MyAccountView(views.View):
     def get(self, request, *args, **kwargs):
         # displays customer's own info, comments, and trusted/untrusted customers
-        customer = Customer.objects.get(username=self.request.user.username)
+        customer = request.customer
         comments = Comment.objects.filter(username=customer)
         trusts = TrustedCustomer.objects.filter(username=customer)
         untrusts = UntrustedCustomer.objects.filter(username=customer)
@@ -119,7 +100,7 @@ class MyAccountView(views.View):
         return render(request, 'my_account.html', context=context)
 
     def post(self, request, *args, **kwargs):
-        current_customer = Customer.objects.get(username=request.user.username)
+        current_customer = request.customer
         # trust or untrust a customer on MyAccount page
         if 'trust' in request.POST:
             target_customer = Customer.objects.get(username=request.POST.get('trust'))
@@ -134,23 +115,22 @@ class MyAccountView(views.View):
 
 @login_required(login_url='login')
 def my_order(request):
-    # get all orders of a customer
-    customer = Customer.objects.get(username=request.user.username)
-    orders = BookOrder.objects.filter(username=customer)
-    orders_value = list(orders.values())
-    for i in range(len(orders)):
-        books_in_order = BookInOrder.objects.filter(order_number=orders[i])
-        orders_value[i]['book_in_order'] = zip([book.isbn for book in books_in_order],
-                                               [book.count for book in books_in_order])
-    print(orders_value)
-    context = {'orders': orders_value}
+    # get a page of orders of a customer, older pages are fetched by order number
+    customer = request.customer
+    try:
+        before = int(request.GET['before'])
+    except (KeyError, ValueError):
+        before = None
+    orders, next_before = get_order_history(customer, before)
+    context = {'orders': orders,
+               'next_before': next_before}
     return render(request, 'bookorder.html', context=context)
 
 
 @login_required(login_url='login')
 def my_question(request):
     # displays customer's questions and answers
-    current_customer = Customer.objects.get(username=request.user.username)
+    current_customer = request.customer
     form = CustomerQuestionForm(request.POST)
     if request.method == 'POST':
         if form.is_valid():
@@ -202,77 +182,45 @@ def sign_up(request):
 
 # special search page for degrees of separation
 class DegreeOfSeparationSearchView(views.View):
-    form = DegreeOfSeparationSearchForm()
-    context = {'form': form}
-
     def get(self, request, *args, **kwargs):
-        return render(request, 'degree_of_separation_search.html', context=self.context)
+        context = {'form': DegreeOfSeparationSearchForm()}
+        return render(request, 'degree_of_separation_search.html', context=context)
 
     def post(self, request, *args, **kwargs):
-        author = request.POST.get('author')
-        firstname, lastname = author.split('_')
-        degree = int(request.POST.get('degree_of_separation'))
+        form = DegreeOfSeparationSearchForm(request.POST)
+        if not form.is_valid():
+            messages.error(request, "Error:")
+            for _, error in form.errors.items():
+                messages.error(request, error)
+            return render(request, 'degree_of_separation_search.html', context={'form': form})
+        firstname, lastname = form.cleaned_data['author'].split('_')
+        degree = form.cleaned_data['degree_of_separation']
         context = {'first_name_searched_on': firstname,
-                   'last_name_searched_on': lastname}
-        # raw SQL for authors with degree 1 relationship
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT A2.first_name, A2.last_name '
-                           'FROM home_author A1 join home_author A2 on A1.isbn_id = A2.isbn_id '
-                           'WHERE A1.first_name = %s AND A1.last_name = %s '
-                           'AND A2.first_name != %s AND A2.last_name != %s',
-                           [firstname, lastname, firstname, lastname])
-            raw_separated_authors = cursor.fetchall()
-        if degree == 1:
-            context['degree'] = 1
-        elif degree == 2:
-            # helper to see if there exists a degree 1 relationship
-            def degree1Exists(fn, ln, fn_from_search, ln_from_search):
-                with connection.cursor() as c:
-                    c.execute('SELECT A2.first_name, A2.last_name '
-                              'FROM home_author A1 join home_author A2 on A1.isbn_id = A2.isbn_id '
-                              'WHERE A1.first_name = %s AND A1.last_name = %s '
-                              'AND A2.first_name != %s AND A2.last_name != %s '
-                              'AND A2.first_name != %s AND A2.last_name != %s',
-                              [fn, ln, fn, ln, fn_from_search, ln_from_search])
-                    result = c.fetchall()
-                    return result
-
-            temp_raw_author = []
-            # for degree 2 search, only keep authors who have no degree 1 relationship among each other
-            [temp_raw_author.append(raw_author) for raw_author in raw_separated_authors
-             if not degree1Exists(raw_author[0], raw_author[1], firstname, lastname)]
-            raw_separated_authors = temp_raw_author
-            context['degree'] = 2
-        # turn raw result into a dict with meaningful keys
-        context['authors'] = [dict(zip(['first_name', 'last_name'], raw_author))
-                              for raw_author in raw_separated_authors]
-        # get the books the target authors write
-        for author in context['authors']:
-            author['books'] = Book.objects.filter(author__first_name=author['first_name'],
-                                                  author__last_name=author['last_name']).order_by('title')
+                   'last_name_searched_on': lastname,
+                   'degree': degree}
+        # breadth first search in the in-memory co-author graph
+        graph = get_coauthor_graph()
+        names = sorted(graph.authors_at_degree((firstname, lastname), degree), key=lambda name: (name[1], name[0]))
+        # get the books the target authors write in one query
+        books = Book.objects.in_bulk({isbn for name in names for isbn in graph.books_of(name)})
+        context['authors'] = [{'first_name': name[0],
+                               'last_name': name[1],
+                               'books': sorted((books[isbn] for isbn in graph.books_of(name) if isbn in books),
+                                               key=lambda book: book.title)}
+                              for name in names]
         return render(request, 'degree_of_separation_search_result.html', context=context)
 
 
+@cache_anonymous_page(lambda request, isbn_str: [CATALOG_VERSION, book_version(isbn_str)])
 def book_detail(request, isbn_str):
     if request.method == 'POST':
         if request.user.is_authenticated:
-            current_customer = Customer.objects.get(username=request.user.username)
+            current_customer = request.customer
             # add to shopping cart
             if 'add_to_shopping_cart' in request.POST:
-                try:
-                    # book added before, increase the count by 1
-                    book_in_cart = ShoppingCart.objects.get(username=current_customer,
-                                                            isbn=isbn_str)
-                    book_in_cart.count += 1
-                    book_in_cart.save()
-                    return redirect(shopping_cart)
-                except ShoppingCart.DoesNotExist:
-                    # book first time added, count is 1
-                    shopping_cart_item = ShoppingCart.objects.create(username=current_customer,
-                                                                     isbn=Book.objects.get(isbn=isbn_str),
-                                                                     count=1)
-                    shopping_cart_item.save()
-                    return redirect(shopping_cart)
+                if not add_to_cart(current_customer, isbn_str):
+                    raise Http404('ISBN does not exist')
+                return redirect(shopping_cart)
             # comment submitted
             elif 'comment_textarea' in request.POST:
                 # banned customer
@@ -287,43 +235,32 @@ def book_detail(request, isbn_str):
                     return render_book_detail(request, isbn_str)
                 except Comment.DoesNotExist:
                     # current user has never commented, can proceed
-                    new_comment = Comment.objects.create(username=current_customer,
-                                                         isbn=Book.objects.get(isbn=isbn_str),
-                                                         score=request.POST.get('scores'),
-                                                         comment_text=request.POST.get('comment_textarea'))
-                    new_comment.save()
+                    add_comment(current_customer, isbn_str, request.POST.get('scores'),
+                                request.POST.get('comment_textarea'))
                     messages.info(request, mark_safe("Your comment is successfully recorded<br>"))
                     return render_book_detail(request, isbn_str)
             # comment rated
             else:
+                comment_id = request.POST.get('comment_id')
+                rating = next((rating for rating in USEFULNESS_WEIGHTS if rating in request.POST), None)
+                if rating is not None:
+                    try:
+                        rate_comment(current_customer, isbn_str, comment_id, rating)
+                    except Comment.DoesNotExist:
+                        return HttpResponse(f'Unknown error in {book_detail.__name__}, please refresh and try again')
+                    except CannotRateComment as e:
+                        messages.error(request, mark_safe(f'{e} <br>'))
+                    return render_book_detail(request, isbn_str)
+
                 try:
-                    comment = Comment.objects.get(id=request.POST.get('comment_id'))
+                    comment = Comment.objects.select_related('username').get(id=comment_id)
                 except Comment.DoesNotExist:
                     return HttpResponse(f'Unknown error in {book_detail.__name__}, please refresh and try again')
-
-                if comment.username == current_customer:
+                if comment.username_id == current_customer.pk:
                     messages.error(request,
-                                   mark_safe('You cannot rate your own comment! <br>'))
-                    return render_book_detail(request, isbn_str)
-                if 'very_useful' in request.POST:
-                    comment.very_useful_count += 1
-                    comment.usefulness_score = \
-                        (comment.very_useful_count * 2 + comment.useful_count + comment.useless_count * -1) / 3.0
-                    comment.save()
+                                   mark_safe('You cannot trust or untrust yourself! <br>'))
                     return render_book_detail(request, isbn_str)
-                elif 'useful' in request.POST:
-                    comment.useful_count += 1
-                    comment.usefulness_score = \
-                        (comment.very_useful_count + comment.useful_count + comment.useless_count) / 3.0
-                    comment.save()
-                    return render_book_detail(request, isbn_str)
-                elif 'useless' in request.POST:
-                    comment.useless_count += 1
-                    comment.usefulness_score = \
-                        (comment.very_useful_count + comment.useful_count + comment.useless_count) / 3.0
-                    comment.save()
-                    return render_book_detail(request, isbn_str)
-                elif 'trust' in request.POST:
+                if 'trust' in request.POST:
                     change_customer_trust_status(current_customer, comment.username, 'trust')
                     messages.info(request, mark_safe(f'You have successfully trusted "{comment.username}"'))
                     return render_book_detail(request, isbn_str)
@@ -348,19 +285,18 @@ class AdminUserStatView(views.View):
                 return HttpResponse('Please enter a positive integer')
         except ValueError:
             return HttpResponse('Please enter a positive integer')
-        context = {}
+        # the aggregates change without a version to follow, so reports are kept for the reports tier's time to live
+        context = {'report_timeout': caches[REPORTS_TIER].default_timeout}
+        # top customers read from the maintained aggregates in index order
+        customers = Customer.objects.values('username', 'first_name', 'last_name', 'address', 'phone_number', 'banned',
+                                            'trust_count', 'untrust_count', 'net_trust', 'average_usefulness')
         if 'top_trusted' in request.POST:
-            customers = (Customer.objects.values(
-                'username', 'first_name', 'last_name', 'address', 'phone_number', 'banned')) \
-                            .annotate(Count('t_trusted_username')).order_by('-t_trusted_username__count')[:number]
-            context['customers'] = customers
+            context['customers'] = get_or_compute(f'top_trusted:{number}', None, lambda: list(
+                customers.order_by('-net_trust', 'user_ptr')[:number]), REPORTS_TIER)
             context['trust'] = 1
         elif 'top_useful' in request.POST:
-            customers = Customer.objects.values(
-                'username', 'first_name', 'last_name', 'address', 'phone_number', 'banned') \
-                            .annotate(usefulness_score=Avg('comment__usefulness_score')) \
-                            .order_by('-usefulness_score')[:number]
-            context['customers'] = customers
+            context['customers'] = get_or_compute(f'top_useful:{number}', None, lambda: list(
+                customers.order_by('-average_usefulness', 'user_ptr')[:number]), REPORTS_TIER)
             context['useful'] = 1
         return render(request, 'admin_user_stat_view.html', context=context)
 
@@ -369,37 +305,75 @@ class AdminUserStatView(views.View):
 @method_decorator(staff_member_required(login_url='admin:login'), name='dispatch')
 class AdminBookStatView(views.View):
     def get(self, request, *args, **kwargs):
-        return render(request, 'admin_book_stat_view.html')
+        return render(request, 'admin_book_stat_view.html', context={'days': settings.SALES_REPORT_DAYS})
 
     def post(self, request, *args, **kwargs):
         try:
             number = int(request.POST.get('number'))
-            if number <= 0:
+            days = int(request.POST.get('days', settings.SALES_REPORT_DAYS))
+            if number <= 0 or days <= 0:
                 return HttpResponse('Please enter a positive integer')
         except ValueError:
             return HttpResponse('Please enter a positive integer')
-        context = {}
-        # recent quarter
-        one_quarter_ago = datetime.now() - timedelta(days=90)
+        context = {'days': days}
+        # sales of the last `days` days, today included, summed from the daily rollups
+        first_day = timezone.localdate() - timedelta(days=days - 1)
         if 'top_books' in request.POST:
-            books = BookInOrder.objects.filter(order_number__order_time__gt=one_quarter_ago) \
-                        .values('isbn', 'isbn__title').annotate(count=Sum('count')) \
-                        .order_by('-count')[:number]
-            context['results'] = books
+            results = DailyBookSales.objects.filter(day__gte=first_day) \
+                          .values('isbn', 'isbn__title').annotate(count=Sum('quantity')) \
+                          .order_by('-count', 'isbn')[:number]
             context['result_type'] = 'books'
         elif 'top_authors' in request.POST:
-            authors = Book.objects.filter(bookinorder__order_number__order_time__gt=one_quarter_ago) \
-                          .values('author__first_name', 'author__last_name') \
-                          .annotate(count=Sum('bookinorder__count')) \
-                          .order_by('-count')[:number]
-            print(authors)
-            context['results'] = authors
+            results = DailyAuthorSales.objects.filter(day__gte=first_day) \
+                          .values('first_name', 'last_name').annotate(count=Sum('quantity')) \
+                          .order_by('-count', 'last_name', 'first_name')[:number]
             context['result_type'] = 'authors'
         elif 'top_publishers' in request.POST:
-            publishers = Book.objects.filter(bookinorder__order_number__order_time__gt=one_quarter_ago) \
-                             .values('publisher').annotate(count=Sum('bookinorder__count')) \
-                             .order_by('-count')[:number]
-            print(publishers)
-            context['results'] = publishers
+            results = DailyPublisherSales.objects.filter(day__gte=first_day) \
+                          .values('publisher').annotate(count=Sum('quantity')) \
+                          .order_by('-count', 'publisher')[:number]
             context['result_type'] = 'publishers'
+        if 'result_type' in context:
+            # cached until the next sale
+            context['results'] = get_or_compute(f'top_{context["result_type"]}:{first_day}:{number}', SALES_VERSION,
+                                                lambda: list(results), REPORTS_TIER)
         return render(request, 'admin_book_stat_view.html', context=context)
+
+
+# manager only page for query counts and latencies per view, ?format=prometheus for the Prometheus text format
+@staff_member_required(login_url='admin:login')
+def admin_view_stats(request):
+    summary = view_stats.summary()
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(prometheus_text(summary), content_type='text/plain; version=0.0.4')
+    # one row per view, queries as counts and times in milliseconds
+    rows = [{'view': view,
+             'requests': metrics['wall_time']['count'],
+             'values': [metrics[metric][quantile] if metric == 'queries' else round(metrics[metric][quantile] * 1000, 1)
+                        for metric in METRICS for quantile in QUANTILES]}
+            for view, metrics in summary.items()]
+    context = {'rows': rows,
+               'metrics': METRICS,
+               'quantiles': [f'p{round(quantile * 100)}' for quantile in QUANTILES]}
+    return render(request, 'admin_view_stats.html', context=context)
+
+
+# manager only page for the hits, misses and evictions of every cache tier since the process started,
+# ?format=prometheus for the Prometheus text format
+@staff_member_required(login_url='admin:login')
+def admin_cache_stats(request):
+    summary = cache_stats.summary(settings.CACHES)
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(cache_prometheus_text(summary), content_type='text/plain; version=0.0.4')
+    rows = []
+    for tier, config in settings.CACHES.items():
+        tier_cache = caches[tier]
+        counts = summary[tier]
+        rows.append({'tier': tier,
+                     'backend': config['BACKEND'].rsplit('.', 1)[-1],
+                     'timeout': tier_cache.default_timeout,
+                     'max_entries': config['OPTIONS'].get('MAX_ENTRIES'),
+                     'size': tier_cache.size() if hasattr(tier_cache, 'size') else None,
+                     'counts': [counts[stat] for stat in STATS],
+                     'hit_rate': round(counts['hit_rate'] * 100, 1)})
+    return render(request, 'admin_cache_stats.html', context={'rows': rows, 'stats': STATS})